@@ -1,10 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-function-docstring
+"""
+check IP addresses against the AbuseIPDB API
+
+The addresses are looked up concurrently, paced by a token bucket within the API quota, with results
+cached between runs and the output resumable after an interrupted run.
+
+required modules:
+- httpx
+- python-dotenv
+"""
 import argparse
+import asyncio
+import bisect
+import heapq
 import ipaddress
 import json
 import logging
 import os
+import random
+import sqlite3
 import sys
+import time
+from array import array
+from collections import Counter, deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Iterator
+from contextlib import nullcontext
 from pprint import pformat
+from typing import TextIO
 
 import httpx
 from dotenv import load_dotenv
@@ -12,14 +36,376 @@
 # Defining the api-endpoint
 ABUSEIPDB_API_ENDPOINT = 'https://api.abuseipdb.com/api/v2/check'
 
+MAX_AGE_IN_DAYS = 180
+
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+# how many finished lookups may wait behind a slow one when output keeps input order
+ORDERED_WINDOW_FACTOR = 4
+
+# responses meaning "slow down", the IP is retried instead of being dropped
+THROTTLED_STATUS_CODES = (429, 503)
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 300.0
+
+# lowest pace the limiter falls back to after repeated throttling, requests per second
+MIN_RATE = 0.1
+
+# addresses never worth a lookup: private, shared, loopback, link-local, documentation,
+# benchmarking, multicast and reserved ranges, for IPv6 everything outside of 2000::/3 too
+NON_PUBLIC_CIDRS = [
+    '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16',
+    '172.16.0.0/12', '192.0.0.0/24', '192.0.2.0/24', '192.88.99.0/24', '192.168.0.0/16',
+    '198.18.0.0/15', '198.51.100.0/24', '203.0.113.0/24', '224.0.0.0/4', '240.0.0.0/4',
+    '::/3', '4000::/2', '8000::/1',
+    '2001:2::/48', '2001:10::/28', '2001:20::/28', '2001:db8::/32',
+]
+
+# cache writes are committed in batches, a crash loses at most that many results
+CACHE_COMMIT_EVERY = 500
+
+# new address keys are collected in a plain set, then sorted into compact runs of the key set
+IP_KEY_SET_BUFFER = 65_536
+
+WORD_MASK = (1 << 64) - 1
+
+
+class RateLimiter:
+    """
+    token bucket pacing the API calls, adjusted by the rate limit headers returned by AbuseIPDB
+
+    The rate is halved on every throttled response and recovers step by step on successful ones,
+    so the batch settles at the highest pace the API accepts.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # waiters queue on the lock, so the tokens are handed out in FIFO order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, delay: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.tokens = 0.0
+
+    def throttled(self, delay: float) -> None:
+        # requests in flight get throttled together, the rate is lowered once per pause
+        if time.monotonic() >= self.paused_until:
+            self.rate = max(MIN_RATE, self.rate / 2)
+        self.pause(delay)
+        logging.warning("Throttled by the API, pausing for %.1fs, rate lowered to %.2f req/s",
+                        delay, self.rate)
+
+    def observe(self, response: httpx.Response) -> None:
+        if response.status_code not in THROTTLED_STATUS_CODES:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining == '0' and reset and reset.isdigit():
+            delay = int(reset) - time.time()
+            if delay > 0:
+                logging.warning("API quota exhausted, waiting %.0fs for the reset", delay)
+                self.pause(delay)
+
+
+class CidrIndex:  # pylint: disable=too-few-public-methods
+    """
+    set of networks kept as sorted, merged integer intervals per IP version, looked up with bisect
+    """
+    def __init__(self, cidrs: Iterable[str]):
+        intervals: dict[int, list[tuple[int, int]]] = {4: [], 6: []}
+        for cidr in cidrs:
+            network = ipaddress.ip_network(cidr, strict=False)
+            intervals[network.version].append((int(network.network_address),
+                                                int(network.broadcast_address)))
+
+        self.starts: dict[int, list[int]] = {}
+        self.ends: dict[int, list[int]] = {}
+        for version, ranges in intervals.items():
+            merged: list[list[int]] = []
+            for start, end in sorted(ranges):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+
+            self.starts[version] = [start for start, _ in merged]
+            self.ends[version] = [end for _, end in merged]
+
+    def __contains__(self, ip_obj: ipaddress.IPv4Address | ipaddress.IPv6Address) -> bool:
+        ip_int = int(ip_obj)
+        position = bisect.bisect_right(self.starts[ip_obj.version], ip_int) - 1
+        return position >= 0 and ip_int <= self.ends[ip_obj.version][position]
+
+
+class IpKeySet:
+    """
+    set of IP address keys kept as sorted runs of 64-bit words, 8 bytes per IPv4 and 16 per IPv6 address
+    instead of about 70 in a set of ints
+
+    New keys wait in a small set, a full one is sorted into a run per IP version and runs of similar size
+    are merged, so a lookup bisects a logarithmic number of runs. An IPv6 run keeps the upper and the lower
+    halves of the addresses in two arrays, the second one is bisected within the range of equal upper halves.
+    """
+    def __init__(self):
+        self.runs: dict[int, list[tuple[array, ...]]] = {1: [], 2: []}
+        self.buffer: set[int] = set()
+        self.size = 0
+
+    @staticmethod
+    def split(key: int) -> tuple[int, ...]:
+        if key >> 128:
+            return (key >> 64) & WORD_MASK, key & WORD_MASK
+        return (key,)
+
+    @staticmethod
+    def build_run(width: int, keys: Iterable[tuple[int, ...]]) -> tuple[array, ...]:
+        run = tuple(array('Q') for _ in range(width))
+        for words in keys:
+            for column, word in zip(run, words):
+                column.append(word)
+        return run
+
+    def __contains__(self, key: int) -> bool:
+        if key in self.buffer:
+            return True
+
+        words = self.split(key)
+        for run in self.runs[len(words)]:
+            low, high = 0, len(run[0])
+            for column, word in zip(run, words):
+                low = bisect.bisect_left(column, word, low, high)
+                high = bisect.bisect_right(column, word, low, high)
+                if low == high:
+                    break
+            else:
+                return True
+
+        return False
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, key: int) -> None:
+        """
+        adds a key not in the set yet, the callers check it first anyway
+        """
+        self.buffer.add(key)
+        self.size += 1
+        if len(self.buffer) >= IP_KEY_SET_BUFFER:
+            self.flush()
+
+    def flush(self) -> None:
+        keys = sorted(self.split(key) for key in self.buffer)
+        self.buffer.clear()
+
+        for width, runs in self.runs.items():
+            run = self.build_run(width, (words for words in keys if len(words) == width))
+            if not run[0]:
+                continue
+
+            # merged word by word, the memory stays at the size of the runs
+            while runs and len(runs[-1][0]) <= 2 * len(run[0]):
+                run = self.build_run(width, heapq.merge(zip(*runs.pop()), zip(*run)))
+            runs.append(run)
+
+
+class ResultCache:
+    """
+    on-disk SQLite cache of the lookup results, keyed by IP address and maxAgeInDays
+
+    Entries older than the TTL are ignored and purged, the oldest entries are evicted
+    when the cache grows above max_entries.
+    """
+    def __init__(self, file_name: str, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.pending_writes = 0
+
+        self.db = sqlite3.connect(file_name)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                        'ip_address TEXT NOT NULL, '
+                        'max_age_in_days INTEGER NOT NULL, '
+                        'fetched REAL NOT NULL, '
+                        'payload TEXT NOT NULL, '
+                        'PRIMARY KEY (ip_address, max_age_in_days))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_fetched ON results (fetched)')
+        self.db.execute('DELETE FROM results WHERE fetched < ?', (time.time() - self.ttl,))
+        self.db.commit()
+
+    def __enter__(self) -> 'ResultCache':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def get(self, ip_address: str) -> dict | None:
+        row = self.db.execute('SELECT payload FROM results '
+                              'WHERE ip_address = ? AND max_age_in_days = ? AND fetched >= ?',
+                              (ip_address, MAX_AGE_IN_DAYS, time.time() - self.ttl)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, ip_address: str, ip_details: dict) -> None:
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                        (ip_address, MAX_AGE_IN_DAYS, time.time(), json.dumps(ip_details)))
+
+        self.pending_writes += 1
+        if self.pending_writes >= CACHE_COMMIT_EVERY:
+            self.db.commit()
+            self.pending_writes = 0
+
+    def close(self) -> None:
+        self.db.execute('DELETE FROM results WHERE rowid IN '
+                        '(SELECT rowid FROM results ORDER BY fetched DESC LIMIT -1 OFFSET ?)',
+                        (self.max_entries,))
+        self.db.commit()
+        self.db.close()
+
+        logging.info("Cache hits: %d, misses: %d", self.hits, self.misses)
+
+
+def get_backoff_delay(attempt: int) -> float:
+    # the exponent is bounded, a long throttled streak would overflow the float otherwise
+    return random.uniform(0.5, 1.0) * min(BACKOFF_CAP, BACKOFF_BASE * 2 ** min(attempt, 32))
+
+
+def get_retry_after(response: httpx.Response) -> float | None:
+    retry_after = response.headers.get('Retry-After', '')
+    return float(retry_after) if retry_after.isdigit() else None
+
+
 def get_querystring(ip_address: str) -> dict:
-    ip_obj = ipaddress.IPv4Address(ip_address)
+    ip_obj = ipaddress.ip_address(ip_address)
 
     return {
         'ipAddress': str(ip_obj),
-        'maxAgeInDays': '180'
+        'maxAgeInDays': str(MAX_AGE_IN_DAYS)
     }
 
+def parse_ip_address(line: str) -> ipaddress.IPv4Address | ipaddress.IPv6Address:
+    ip_obj = ipaddress.ip_address(line)
+
+    if ip_obj.version == 6 and ip_obj.ipv4_mapped is not None:
+        return ip_obj.ipv4_mapped
+
+    return ip_obj
+
+
+def get_ip_key(ip_obj: ipaddress.IPv4Address | ipaddress.IPv6Address) -> int:
+    # IPv6 keys get a bit above the 128-bit range, so they never collide with IPv4 ones
+    return int(ip_obj) if ip_obj.version == 4 else int(ip_obj) | 1 << 128
+
+
+def unique_public_ip_addresses(lines: Iterable[str],
+                               excluded: CidrIndex,
+                               completed: IpKeySet | None = None) -> Iterator[str]:
+    completed = completed or IpKeySet()
+    seen = IpKeySet()
+    stats: Counter = Counter()
+
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        stats['lines'] += 1
+
+        try:
+            ip_obj = parse_ip_address(line)
+        except ValueError:
+            logging.warning("Skipping invalid IP address: %s", line)
+            stats['invalid'] += 1
+            continue
+
+        ip_key = get_ip_key(ip_obj)
+        if ip_key in seen:
+            stats['duplicate'] += 1
+            continue
+        seen.add(ip_key)
+
+        if ip_key in completed:
+            stats['completed'] += 1
+            continue
+
+        if ip_obj in excluded:
+            logging.debug("Skipping non-public or allow-listed IP address: %s", ip_obj)
+            stats['excluded'] += 1
+            continue
+
+        stats['unique'] += 1
+        yield str(ip_obj)
+
+    logging.info("Input addresses: %d, invalid: %d, duplicates: %d, already checked: %d, excluded: %d, "
+                 "to check: %d", stats['lines'], stats['invalid'], stats['duplicate'], stats['completed'],
+                 stats['excluded'], stats['unique'])
+
+
+def read_completed_ip_keys(file_name: str) -> IpKeySet:
+    completed = IpKeySet()
+    valid_size = 0
+
+    try:
+        with open(file_name, 'rb+') as out_file:
+            for line in out_file:
+                if not line.endswith(b'\n'):
+                    # a run killed in the middle of a write leaves a partial last line behind
+                    logging.warning("Dropping unterminated last line at offset %d of %s", valid_size, file_name)
+                    out_file.truncate(valid_size)
+                    break
+
+                try:
+                    ip_key = get_ip_key(parse_ip_address(json.loads(line)['ipAddress']))
+                except (ValueError, KeyError, TypeError):
+                    # kept in the file, the address is looked up again
+                    logging.warning("Skipping malformed line at offset %d of %s", valid_size, file_name)
+                else:
+                    if ip_key not in completed:
+                        completed.add(ip_key)
+
+                valid_size += len(line)
+
+    except FileNotFoundError:
+        logging.info("No previous output in %s, starting from scratch", file_name)
+
+    logging.info("Results already present in %s: %d", file_name, len(completed))
+
+    return completed
+
+
+def read_cidrs(file_name: str) -> list[str]:
+    with open(file_name, 'r', encoding='utf-8') as cidr_file:
+        return [line.strip() for line in cidr_file
+                if line.strip() and not line.strip().startswith('#')]
+
+
 def get_headers() -> dict:
     return {
         'Accept': 'application/json',
@@ -54,9 +440,176 @@ def args_parser() -> argparse.Namespace:
                         help='name of the input file',
                         required=True)
 
+    parser.add_argument('-a', '--allow-list',
+                        help='file with CIDRs (one per line) excluded from the lookups')
+
+    parser.add_argument('--resume',
+                        action='store_true',
+                        default=False,
+                        help='keep results already in the output file and append only the missing ones')
+
+    parser.add_argument('-c', '--concurrency',
+                        type=int,
+                        default=10,
+                        help='number of lookups running in parallel, default 10')
+
+    parser.add_argument('--order',
+                        choices=['input', 'completion'],
+                        default='input',
+                        help='write results in input order or as soon as they complete, default input')
+
+    parser.add_argument('-r', '--rate',
+                        type=float,
+                        default=10.0,
+                        help='maximal number of API requests per second, default 10')
+
+    parser.add_argument('--max-retries',
+                        type=int,
+                        default=5,
+                        help='how many times a failed lookup is retried, default 5, '
+                             'throttled lookups are retried until they get through')
+
+    parser.add_argument('--cache',
+                        help='SQLite file caching the results between runs, caching disabled if not set')
+
+    parser.add_argument('--cache-ttl',
+                        type=float,
+                        default=24.0,
+                        help='hours a cached result stays valid, default 24')
+
+    parser.add_argument('--cache-size',
+                        type=int,
+                        default=1_000_000,
+                        help='maximal number of results kept in the cache, default 1000000')
+
     return parser.parse_args()
 
 
+async def fetch_ip_details(client: httpx.AsyncClient,
+                           limiter: RateLimiter,
+                           ip_address: str,
+                           max_retries: int) -> dict | None:
+    try:
+        querystring = get_querystring(ip_address)
+    except ValueError as e:
+        logging.error("Invalid IP address %s: %s", ip_address, str(e))
+        return None
+
+    attempt = throttled = 0
+    while True:
+        await limiter.acquire()
+
+        try:
+            response = await client.get(url=ABUSEIPDB_API_ENDPOINT, params=querystring)
+        except httpx.TransportError as e:
+            if attempt >= max_retries:
+                logging.error("Giving up on IP %s after %d attempts: %s", ip_address, attempt + 1, str(e))
+                return None
+
+            delay = get_backoff_delay(attempt)
+            attempt += 1
+            logging.warning("Transport error for IP %s, retrying in %.1fs: %s", ip_address, delay, str(e))
+            await asyncio.sleep(delay)
+            continue
+
+        limiter.observe(response)
+
+        if response.status_code in THROTTLED_STATUS_CODES:
+            # not counted against the retries, the limiter pause already slows the whole batch down
+            limiter.throttled(get_retry_after(response) or get_backoff_delay(throttled))
+            throttled += 1
+            continue
+
+        try:
+            response.raise_for_status()
+            decoded_response = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logging.error("HTTP error occurred for IP %s: %s", ip_address, str(e))
+            return None
+
+        break
+
+    logging.debug("Received response for IP %s: %s", ip_address, pformat(decoded_response))
+
+    return {
+        'ipAddress': decoded_response['data']['ipAddress'],
+        'abuseConfidenceScore': decoded_response['data']['abuseConfidenceScore'],
+        'countryCode': decoded_response['data']['countryCode'],
+        'usageType': decoded_response['data']['usageType'],
+        'isp': decoded_response['data']['isp']
+    }
+
+
+async def results_in_input_order(fetch: Callable[[str], Awaitable[dict | None]],
+                                 ip_addresses: Iterable[str],
+                                 concurrency: int) -> AsyncIterator[dict | None]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded_fetch(ip_address: str) -> dict | None:
+        async with semaphore:
+            return await fetch(ip_address)
+
+    window: deque[asyncio.Task] = deque()
+    for ip_address in ip_addresses:
+        window.append(asyncio.create_task(bounded_fetch(ip_address)))
+        if len(window) >= concurrency * ORDERED_WINDOW_FACTOR:
+            yield await window.popleft()
+
+    while window:
+        yield await window.popleft()
+
+
+async def results_as_completed(fetch: Callable[[str], Awaitable[dict | None]],
+                               ip_addresses: Iterable[str],
+                               concurrency: int) -> AsyncIterator[dict | None]:
+    in_flight: set[asyncio.Task] = set()
+    for ip_address in ip_addresses:
+        if len(in_flight) >= concurrency:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+        in_flight.add(asyncio.create_task(fetch(ip_address)))
+
+    for task in asyncio.as_completed(in_flight):
+        yield await task
+
+
+async def check_ip_addresses(ip_addresses: Iterable[str],
+                             out_file: TextIO,
+                             params: argparse.Namespace,
+                             cache: ResultCache | None) -> None:
+    concurrency = params.concurrency
+    limiter = RateLimiter(params.rate, burst=concurrency)
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(headers=get_headers(),
+                                 limits=limits,
+                                 timeout=HTTP_TIMEOUT) as client:
+        async def fetch(ip_address: str) -> dict | None:
+            if cache is not None and (ip_details := cache.get(ip_address)) is not None:
+                return ip_details
+
+            ip_details = await fetch_ip_details(client, limiter, ip_address, params.max_retries)
+
+            if cache is not None and ip_details is not None:
+                cache.put(ip_address, ip_details)
+
+            return ip_details
+
+        if params.order == 'input':
+            results = results_in_input_order(fetch, ip_addresses, concurrency)
+        else:
+            results = results_as_completed(fetch, ip_addresses, concurrency)
+
+        async for ip_details in results:
+            if ip_details is None:
+                continue
+
+            json.dump(ip_details, out_file)
+            out_file.write('\n')
+
+
 def main():
     params = args_parser()
 
@@ -64,35 +617,30 @@ def main():
 
     logger_setup(params)
 
-    with open(params.input, 'r', encoding='utf-8') as in_file:
-        ip_addresses = in_file.read().splitlines()
-
-    with open(params.output, 'w', encoding='utf-8') as out_file:
-        for ip_address in ip_addresses:
-            ip_address = ip_address.strip()
+    if params.concurrency < 1:
+        logging.error("Concurrency has to be a positive number, got: %d", params.concurrency)
+        sys.exit(1)
 
-            try:
-                response = httpx.get(url=ABUSEIPDB_API_ENDPOINT,
-                                     headers=get_headers(),
-                                     params=get_querystring(ip_address))
-                response.raise_for_status()
-                decoded_response = response.json()
+    if params.rate <= 0:
+        logging.error("Rate has to be a positive number, got: %s", params.rate)
+        sys.exit(1)
 
-                logging.debug("Received response for IP %s: %s", ip_address, pformat(decoded_response))
+    try:
+        excluded = CidrIndex(NON_PUBLIC_CIDRS + (read_cidrs(params.allow_list) if params.allow_list else []))
+    except ValueError as e:
+        logging.error("Invalid allow-list entry: %s", str(e))
+        sys.exit(1)
 
-                ip_details = {
-                    'ipAddress': decoded_response['data']['ipAddress'],
-                    'abuseConfidenceScore': decoded_response['data']['abuseConfidenceScore'],
-                    'countryCode': decoded_response['data']['countryCode'],
-                    'usageType': decoded_response['data']['usageType'],
-                    'isp': decoded_response['data']['isp']
-                }
+    cache_context = (ResultCache(params.cache, params.cache_ttl * 3600, params.cache_size)
+                     if params.cache else nullcontext())
 
-                json.dump(ip_details, out_file)
-                out_file.write('\n')
+    completed = read_completed_ip_keys(params.output) if params.resume else IpKeySet()
 
-            except httpx.HTTPError as e:
-                logging.error("HTTP error occurred for IP %s: %s", ip_address, str(e))
+    with (open(params.input, 'r', encoding='utf-8') as in_file,
+          cache_context as cache,
+          open(params.output, 'a' if params.resume else 'w', encoding='utf-8') as out_file):
+        ip_addresses = unique_public_ip_addresses(in_file, excluded, completed)
+        asyncio.run(check_ip_addresses(ip_addresses, out_file, params, cache))
 
 
 if __name__ == "__main__":
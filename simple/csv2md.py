@@ -3,47 +3,194 @@
 """
 script to convert csv to Markdown table
 
-required modules:
-- tabulate~=0.9
+The table is streamed in two passes over the input, the first one sizes the columns and the second one
+writes the rows, so memory stays proportional to the number of columns. Stdin is spooled to a temporary
+file for the second pass, unless the columns are sized from a sample of the first rows.
 """
 
 import argparse
 import csv
 import logging
+import math
+import shutil
 import sys
+import tempfile
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from itertools import chain, islice
 from pprint import pformat
-from typing import List
+from typing import List, TextIO
 
-from tabulate import tabulate
+# spaces added to the header width, as tabulate does
+HEADER_PADDING = 2
 
 
-def csv_reader(input_file_name: str) -> List[List[str]]:
-    if input_file_name == '-':
-        csv_file = sys.stdin
-    else:
-        # pylint: disable=consider-using-with
-        csv_file = open(input_file_name, 'r', encoding='utf-8', newline='')
+def is_number(value: str) -> bool:
     try:
-        reader = csv.reader(csv_file)
-        return list(reader)
-    finally:
-        if csv_file is not sys.stdin:
-            csv_file.close()
+        number = float(value)
+    except ValueError:
+        return False
+
+    # float() accepts also 'infinity' and 'nan' in any spelling
+    return math.isfinite(number) or value.lower() in ('inf', '-inf', 'nan')
+
+
+class ColumnLayout:
+    """
+    column widths and alignment of a GitHub flavoured Markdown table, built up row by row
+
+    Columns holding only numbers are right aligned on the decimal point, the others are left aligned.
+    """
+    def __init__(self, headers: List[str]):
+        self.headers = [header.strip() for header in headers]
+        self.widths = [len(header) + HEADER_PADDING for header in self.headers]
+        self.numeric = [True] * len(self.headers)
+        self.seen = [False] * len(self.headers)
+        # longest part of the numbers before and after the decimal point
+        self.integer_widths = [0] * len(self.headers)
+        self.fraction_widths = [0] * len(self.headers)
+
+    def add_columns(self, count: int) -> None:
+        for _ in range(count - len(self.widths)):
+            self.headers.append('')
+            self.widths.append(HEADER_PADDING)
+            self.numeric.append(True)
+            self.seen.append(False)
+            self.integer_widths.append(0)
+            self.fraction_widths.append(0)
+
+    def update(self, row: List[str]) -> None:
+        self.add_columns(len(row))
+
+        for column, value in enumerate(row):
+            value = value.strip()
+            if not value:
+                continue
+
+            self.seen[column] = True
+            self.widths[column] = max(self.widths[column], len(value))
+
+            if self.numeric[column] and is_number(value):
+                point = value.find('.')
+                fraction = len(value) - point if point >= 0 else 0
+                self.integer_widths[column] = max(self.integer_widths[column], len(value) - fraction)
+                self.fraction_widths[column] = max(self.fraction_widths[column], fraction)
+            else:
+                self.numeric[column] = False
+
+    def is_numeric(self, column: int) -> bool:
+        return self.numeric[column] and self.seen[column]
+
+    def width(self, column: int) -> int:
+        if self.is_numeric(column):
+            return max(self.widths[column], self.integer_widths[column] + self.fraction_widths[column])
+        return self.widths[column]
+
+    def format_cell(self, column: int, value: str) -> str:
+        value = value.strip()
+
+        if column >= len(self.widths):
+            # beyond the sized columns when sizing from a sample
+            return value
+
+        if self.is_numeric(column) and value:
+            point = value.find('.')
+            fraction = len(value) - point if point >= 0 else 0
+            return (value + ' ' * (self.fraction_widths[column] - fraction)).rjust(self.width(column))
+
+        return value.ljust(self.width(column))
+
+    def format_row(self, row: List[str]) -> str:
+        cells = list(row) + [''] * (len(self.widths) - len(row))
+        return '| ' + ' | '.join(self.format_cell(column, value) for column, value in enumerate(cells)) + ' |'
+
+    def format_header(self) -> str:
+        cells = (header.rjust(self.width(column)) if self.is_numeric(column) else header.ljust(self.width(column))
+                 for column, header in enumerate(self.headers))
+        return '| ' + ' | '.join(cells) + ' |'
+
+    def format_separator(self) -> str:
+        return '|' + '|'.join('-' * (self.width(column) + 2) for column in range(len(self.widths))) + '|'
+
+
+@contextmanager
+def open_csv_input(input_file_name: str, spool: bool) -> Iterator[TextIO]:
+    """
+    opens the input for reading, stdin is copied to a temporary file first when it must be read twice
+    """
+    if input_file_name != '-':
+        with open(input_file_name, 'r', encoding='utf-8', newline='') as csv_file:
+            yield csv_file
+    elif spool:
+        with tempfile.TemporaryFile('w+', encoding='utf-8', newline='') as csv_file:
+            shutil.copyfileobj(sys.stdin, csv_file)
+            csv_file.seek(0)
+            yield csv_file
+    else:
+        yield sys.stdin
 
 
-def write_markdown_table(data: List[List[str]], output_file_name: str):
+@contextmanager
+def open_markdown_output(output_file_name: str) -> Iterator[TextIO]:
     if output_file_name == '-':
-        output_file = sys.stdout
+        yield sys.stdout
     else:
-        # pylint: disable=consider-using-with
-        output_file = open(output_file_name, 'w', encoding='utf-8')
-    try:
-        markdown_table = tabulate(data, headers="firstrow", tablefmt="github")
-        output_file.write(markdown_table)
+        with open(output_file_name, 'w', encoding='utf-8') as output_file:
+            yield output_file
+
+
+def measure_columns(rows: Iterable[List[str]], headers: List[str]) -> ColumnLayout:
+    layout = ColumnLayout(headers)
+    for row in rows:
+        layout.update(row)
+    return layout
+
+
+def write_markdown_rows(layout: ColumnLayout, rows: Iterable[List[str]], output_file: TextIO) -> int:
+    output_file.write(layout.format_header())
+    output_file.write('\n')
+    output_file.write(layout.format_separator())
+    output_file.write('\n')
+
+    count = 0
+    for count, row in enumerate(rows, start=1):
+        output_file.write(layout.format_row(row))
         output_file.write('\n')
-    finally:
-        if output_file is not sys.stdout:
-            output_file.close()
+
+    return count
+
+
+def convert_csv_to_markdown(input_file_name: str, output_file_name: str, sample_rows: int = 0) -> int:
+    """
+    streams the CSV file to a Markdown table
+    :param input_file_name: CSV file, '-' for stdin
+    :param output_file_name: Markdown file, '-' for stdout
+    :param sample_rows: size the columns from this many first rows only, 0 reads the whole input twice
+    :return: number of rows written, without the header
+    """
+    with open_csv_input(input_file_name, spool=not sample_rows) as csv_file:
+        reader = csv.reader(csv_file)
+        headers = next(reader, None)
+        if headers is None:
+            logging.info("Empty input, nothing to convert")
+            return 0
+
+        if sample_rows:
+            # longer values later on overflow their column, the table is still valid Markdown
+            sample = list(islice(reader, sample_rows))
+            layout = measure_columns(sample, headers)
+            rows: Iterable[List[str]] = chain(sample, reader)
+        else:
+            layout = measure_columns(reader, headers)
+            csv_file.seek(0)
+            reader = csv.reader(csv_file)
+            next(reader)
+            rows = reader
+
+        logging.debug("Column widths: %s", layout.widths)
+
+        with open_markdown_output(output_file_name) as output_file:
+            return write_markdown_rows(layout, rows, output_file)
 
 
 def get_cli_arguments() -> argparse.Namespace:
@@ -63,6 +210,12 @@ def get_cli_arguments() -> argparse.Namespace:
                         default='-',
                         help='Markdown file to be written, default stdout')
 
+    parser.add_argument('-s', '--sample_rows',
+                        type=int,
+                        default=0,
+                        help='size the columns from the first rows only, in one pass without spooling stdin, '
+                             'default 0 measures all rows')
+
     return parser.parse_args()
 
 
@@ -76,10 +229,10 @@ def main():
 
     logging.debug("CLI arguments: %s", pformat(cli_arguments))
 
-    payload = csv_reader(cli_arguments.input_file)
-    logging.debug("CSV payload: %s", pformat(payload))
-
-    write_markdown_table(payload, cli_arguments.output_file)
+    row_count = convert_csv_to_markdown(cli_arguments.input_file,
+                                        cli_arguments.output_file,
+                                        cli_arguments.sample_rows)
+    logging.debug("Rows written: %d", row_count)
 
 if __name__ == "__main__":
     main()
@@ -2,24 +2,199 @@
 # pylint: disable=missing-function-docstring
 """
 read multiple CSV files and combine them into a single Excel file
+
+The workbook is written in openpyxl's write-only mode, rows go from the CSV reader straight
+to the file and memory does not grow with the size of the input. A file longer than the Excel
+sheet is continued on extra sheets.
+
+With more workers the files are parsed ahead of the writer in separate processes, one file
+per worker, together with the optional type inference which turns numbers and ISO dates
+into typed cells.
 """
 
 import argparse
 import csv
 import logging
+import multiprocessing
+import queue
+import re
+import sys
+from collections.abc import Iterator
+from contextlib import closing
+from datetime import date, datetime
+from itertools import chain, islice
+from typing import Any, List
 
 from openpyxl import Workbook
 
+# rows in an Excel sheet
+MAX_SHEET_ROWS = 1_048_576
+
+# rows passed at once from a parsing worker to the writer
+CHUNK_ROWS = 10_000
+
+# chunks a worker may parse ahead before it waits for the writer
+QUEUE_CHUNKS = 4
+
+# seconds between checks that a worker which sent nothing is still alive
+WORKER_POLL_INTERVAL = 1.0
 
-def csv_reader(input_file_name: str) -> list:
+# leading zeros mark identifiers, like postal codes, which stay text
+INTEGER_PATTERN = re.compile(r'[+-]?(0|[1-9][0-9]*)')
+FLOAT_PATTERN = re.compile(r'[+-]?([0-9]*\.[0-9]+([eE][+-]?[0-9]+)?|[0-9]+[eE][+-]?[0-9]+)')
+DATE_PATTERN = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')
+# without a UTC offset, Excel has no timezone aware dates
+DATETIME_PATTERN = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}[T ]'
+                              r'[0-9]{2}:[0-9]{2}(:[0-9]{2}(\.[0-9]{1,6})?)?')
+
+# Excel keeps 15 significant digits, longer integers stay text so no digit is lost
+MAX_EXACT_INTEGER = 10 ** 15
+
+
+def csv_reader(input_file_name: str) -> Iterator[List[str]]:
     with open(input_file_name, 'r', encoding='utf-8', newline='') as csv_file:
-        reader = csv.reader(csv_file)
+        yield from csv.reader(csv_file)
+
+
+def infer_cell_type(value: str) -> Any:
+    """
+    converts integers, decimal numbers and ISO dates to Python values, anything else stays text
+    """
+    if not value or not (value[0].isdigit() or value[0] in '+-.'):
+        return value
+
+    try:
+        if INTEGER_PATTERN.fullmatch(value):
+            number = int(value)
+            return number if abs(number) < MAX_EXACT_INTEGER else value
+        if FLOAT_PATTERN.fullmatch(value):
+            return float(value)
+        if DATE_PATTERN.fullmatch(value):
+            return date.fromisoformat(value)
+        if DATETIME_PATTERN.fullmatch(value):
+            return datetime.fromisoformat(value)
+    except ValueError:
+        # out of range dates like 2024-02-30
+        pass
+
+    return value
+
+
+def read_csv_chunks(input_file_name: str, infer_types: bool,
+                    header: bool) -> Iterator[List[List[Any]]]:
+    rows: Iterator[List[Any]] = csv_reader(input_file_name)
+
+    if infer_types:
+        header_rows = list(islice(rows, 1)) if header else []
+        rows = chain(header_rows, ([infer_cell_type(value) for value in row] for row in rows))
+
+    while chunk := list(islice(rows, CHUNK_ROWS)):
+        yield chunk
+
+
+def parse_csv_file(input_file_name: str, infer_types: bool, header: bool,
+                   chunks: multiprocessing.Queue) -> None:
+    """
+    worker process parsing one file, the end of the file or a failure is marked with None
+    """
+    try:
+        for chunk in read_csv_chunks(input_file_name, infer_types, header):
+            chunks.put(chunk)
+    finally:
+        chunks.put(None)
+
 
-        ret_list = []
-        for row in reader:
-            ret_list.append(row)
+def parse_csv_files(input_file_names: List[str], infer_types: bool, header: bool,
+                    workers: int) -> Iterator[tuple[str, Iterator[List[Any]]]]:
+    """
+    yields the rows of every file in the input order, with more workers the next files are parsed
+    in the background while the writer works on the current one
+    """
+    if workers <= 1:
+        for input_file_name in input_file_names:
+            chunks = read_csv_chunks(input_file_name, infer_types, header)
+            yield input_file_name, chain.from_iterable(chunks)
+        return
 
-        return ret_list
+    # the bounded queues hold back the workers ahead of the writer, the memory stays bounded
+    queues = [multiprocessing.Queue(maxsize=QUEUE_CHUNKS) for _ in input_file_names]
+    # daemon workers do not keep the interpreter alive when the writer fails
+    processes = [multiprocessing.Process(target=parse_csv_file,
+                                         args=(input_file_name, infer_types, header, chunks),
+                                         daemon=True)
+                 for input_file_name, chunks in zip(input_file_names, queues)]
+    started = 0
+
+    try:
+        for index, input_file_name in enumerate(input_file_names):
+            while started < min(len(processes), index + workers):
+                processes[started].start()
+                started += 1
+
+            yield input_file_name, chain.from_iterable(read_worker_chunks(queues[index], processes[index]))
+
+            processes[index].join()
+            if processes[index].exitcode:
+                raise ChildProcessError(f"Parsing file {input_file_name} failed "
+                                        f"with exit code {processes[index].exitcode}")
+    finally:
+        for process in processes[:started]:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+def read_worker_chunks(chunks: multiprocessing.Queue,
+                       process: multiprocessing.Process) -> Iterator[List[List[Any]]]:
+    """
+    chunks of one worker until its end mark, a worker killed before the mark ends the file too
+    """
+    while True:
+        try:
+            chunk = chunks.get(timeout=WORKER_POLL_INTERVAL)
+        except queue.Empty:
+            if not process.is_alive() and chunks.empty():
+                # the exit code is checked once the file is over
+                return
+            continue
+
+        if chunk is None:
+            return
+        yield chunk
+
+
+def write_sheets(work_book: Workbook, title: str, rows: Iterator[List[Any]], header: bool) -> int:
+    """
+    appends the rows to a new sheet, continuing on `title (2)`, `title (3)`... past the row limit
+    :param work_book: write-only workbook
+    :param title: title of the first sheet
+    :param rows: rows of the CSV file
+    :param header: the first row is a header, repeated on top of every continuation sheet
+    :return: number of sheets created
+    """
+    header_row = next(rows, None) if header else None
+
+    sheet = work_book.create_sheet(title=title)
+    sheet_count = 1
+    sheet_rows = 0
+    if header_row is not None:
+        sheet.append(header_row)
+        sheet_rows = 1
+
+    for row in rows:
+        if sheet_rows == MAX_SHEET_ROWS:
+            sheet_count += 1
+            logging.info("Sheet %s is full, continuing on sheet %d", title, sheet_count)
+            sheet = work_book.create_sheet(title=f"{title} ({sheet_count})")
+            sheet_rows = 0
+            if header_row is not None:
+                sheet.append(header_row)
+                sheet_rows = 1
+
+        sheet.append(row)
+        sheet_rows += 1
+
+    return sheet_count
 
 
 def get_cli_arguments() -> argparse.Namespace:
@@ -31,6 +206,24 @@ def get_cli_arguments() -> argparse.Namespace:
                         default=False,
                         help='talkative mode')
 
+    parser.add_argument('--header',
+                        action='store_true',
+                        default=False,
+                        help='first row of each file is a header, repeated on continuation sheets')
+
+    parser.add_argument('-t',
+                        '--infer-types',
+                        action='store_true',
+                        default=False,
+                        help='write integers, decimal numbers and ISO dates as typed cells')
+
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        default=1,
+                        help='processes parsing the files ahead of the writer, one file each, '
+                             'default 1')
+
     parser.add_argument('input_file',
                         nargs='+',
                         help='CSV files to be imported')
@@ -49,17 +242,27 @@ def main():
     else:
         logging.basicConfig(level=logging.INFO)
 
-    work_book = Workbook()
-    work_book.remove(work_book.active)
+    work_book = Workbook(write_only=True)
 
-    for input_file in cli_arguments.input_file:
-        logging.info("Reading file: %s", input_file)
+    csv_files = parse_csv_files(cli_arguments.input_file,
+                                cli_arguments.infer_types,
+                                cli_arguments.header,
+                                cli_arguments.workers)
 
-        csv_data = csv_reader(input_file)
+    # closing stops the parsing workers also when the writer fails
+    try:
+        with closing(csv_files):
+            for input_file, rows in csv_files:
+                logging.info("Reading file: %s", input_file)
 
-        sheet = work_book.create_sheet(title=input_file)
-        for row in csv_data:
-            sheet.append(row)
+                sheet_count = write_sheets(work_book, input_file, rows, cli_arguments.header)
+                logging.debug("Sheets written for %s: %d", input_file, sheet_count)
+    except ChildProcessError as err:
+        logging.error("%s", err)
+        # finishes the temporary files of the sheets, nothing is saved
+        for sheet in work_book.worksheets:
+            sheet.close()
+        sys.exit(1)
 
     logging.info("Writing file: %s", cli_arguments.output_file)
     work_book.save(cli_arguments.output_file)
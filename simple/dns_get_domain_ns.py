@@ -6,16 +6,192 @@
 
 required ubuntu packages:
     - python3-dnspython
-    - python3-validators
 """
 import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
 import json
 import logging
+import os
 import sys
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Iterable, Iterator
 from pprint import pformat
+from typing import Any, TextIO
 
+import dns.asyncresolver
+import dns.exception
+import dns.message
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
 import dns.resolver
-import validators
+
+# how many finished lookups may wait behind a slow one, output keeps input order
+ORDERED_WINDOW_FACTOR = 4
+
+
+def read_domains(file_name: str) -> Iterator[str]:
+    """
+    lazily yields domains from the file, one per line, skipping blank lines, comments and duplicates
+    :param file_name: path to the file with domains
+    :return: iterator of unique domains in input order
+    """
+    # 8-byte digests instead of the names themselves keep the memory of seen domains small
+    seen: set[bytes] = set()
+    duplicates = 0
+
+    with open(file_name, 'r', encoding='utf-8') as file:
+        for line in file:
+            domain = line.strip()
+            if not domain or domain.startswith('#'):
+                continue
+
+            digest = hashlib.blake2b(domain.rstrip('.').lower().encode('utf-8'), digest_size=8).digest()
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+
+            yield domain
+
+    logging.debug("Domains read from %s: %d, duplicates skipped: %d", file_name, len(seen), duplicates)
+
+
+class JsonOutputWriter:
+    """
+    writes records one by one, either as NDJSON lines flushed right away or as an indented JSON array
+    identical to `json.dump(records, indent=4)`
+    """
+    def __init__(self, output: TextIO, output_format: str):
+        self.output = output
+        self.ndjson = output_format == 'ndjson'
+        self.count = 0
+
+    def __enter__(self) -> 'JsonOutputWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, record: dict[str, Any]) -> None:
+        if self.ndjson:
+            self.output.write(json.dumps(record, ensure_ascii=True))
+            self.output.write('\n')
+            self.output.flush()
+        else:
+            self.output.write(',\n    ' if self.count else '[\n    ')
+            self.output.write(json.dumps(record, indent=4, ensure_ascii=True).replace('\n', '\n    '))
+
+        self.count += 1
+
+    def close(self) -> None:
+        if not self.ndjson:
+            self.output.write('\n]' if self.count else '[]')
+        self.output.flush()
+
+
+class PersistentCache(dns.resolver.LRUCache):
+    """
+    resolver cache which also keeps the answers put into it, so they can be saved between runs
+    without reading the internals of the dnspython cache
+    """
+    def __init__(self, max_size: int):
+        super().__init__(max_size)
+        self.capacity = max_size
+        self.answers: dict[tuple[dns.name.Name, int, int], dns.resolver.Answer] = {}
+
+    def put(self, key: tuple[dns.name.Name, int, int], value: dns.resolver.Answer) -> None:
+        super().put(key, value)
+
+        # the oldest answers go first once there are more than the cache holds
+        self.answers.pop(key, None)
+        self.answers[key] = value
+        if len(self.answers) > self.capacity:
+            del self.answers[next(iter(self.answers))]
+
+
+class ResolverPool:  # pylint: disable=too-few-public-methods
+    """
+    async resolvers handed out round-robin, one per upstream nameserver, to spread the queries
+    """
+    def __init__(self,
+                 nameservers: list[str] | None,
+                 port: int,
+                 timeout: float,
+                 cache: PersistentCache):
+        if nameservers:
+            self.resolvers = []
+            for nameserver in nameservers:
+                resolver = dns.asyncresolver.Resolver(configure=False)
+                resolver.nameservers = [nameserver]
+                resolver.port = port
+                self.resolvers.append(resolver)
+        else:
+            resolver = dns.asyncresolver.Resolver()
+            resolver.rotate = True
+            self.resolvers = [resolver]
+
+        # one cache for all the resolvers, answers do not depend on the nameserver asked
+        for resolver in self.resolvers:
+            resolver.timeout = timeout
+            resolver.lifetime = timeout
+            resolver.cache = cache
+
+        self.cycle = itertools.cycle(self.resolvers)
+
+    def next(self) -> dns.asyncresolver.Resolver:
+        return next(self.cycle)
+
+
+def load_dns_cache(cache: PersistentCache, file_name: str) -> None:
+    try:
+        with open(file_name, 'r', encoding='utf-8') as cache_file:
+            entries = json.load(cache_file)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as err:
+        logging.warning("DNS cache %s unusable: %s", file_name, str(err))
+        return
+
+    now = time.time()
+    for entry in entries:
+        if entry['expiration'] <= now:
+            continue
+
+        qname = dns.name.from_text(entry['qname'])
+        rdtype = dns.rdatatype.RdataType(entry['rdtype'])
+        rdclass = dns.rdataclass.RdataClass(entry['rdclass'])
+        answer = dns.resolver.Answer(qname, rdtype, rdclass,
+                                     dns.message.from_wire(base64.b64decode(entry['response'])))
+        # the TTL keeps counting down from the original query, not from the load
+        answer.expiration = entry['expiration']
+        cache.put((qname, rdtype, rdclass), answer)
+
+    logging.debug("DNS cache entries loaded from %s: %d", file_name, len(cache.answers))
+
+
+def save_dns_cache(cache: PersistentCache, file_name: str) -> None:
+    now = time.time()
+    entries = [
+        {
+            'qname': qname.to_text(),
+            'rdtype': int(rdtype),
+            'rdclass': int(rdclass),
+            'expiration': answer.expiration,
+            'response': base64.b64encode(answer.response.to_wire()).decode('ascii')
+        }
+        for (qname, rdtype, rdclass), answer in cache.answers.items()
+        if answer.expiration > now
+    ]
+
+    temp_file = f"{file_name}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as cache_file:
+        json.dump(entries, cache_file)
+    os.replace(temp_file, file_name)
 
 
 def args_parser() -> argparse.Namespace:
@@ -40,6 +216,50 @@ def args_parser() -> argparse.Namespace:
                        type=str,
                        help='Path to file with domains (one per line)')
 
+    parser.add_argument('-o', '--output-format',
+                        choices=['json', 'ndjson'],
+                        default='json',
+                        help='JSON array or NDJSON records written as soon as they are ready, default json')
+
+    parser.add_argument('-n', '--nameserver',
+                        action='append',
+                        help='upstream nameserver IP address, can be repeated to spread the load, '
+                             'system resolvers used if not set')
+
+    parser.add_argument('-p', '--port',
+                        type=int,
+                        default=53,
+                        help='port of the upstream nameservers, default 53')
+
+    parser.add_argument('-c', '--concurrency',
+                        type=int,
+                        default=50,
+                        help='number of queries running in parallel, default 50')
+
+    parser.add_argument('-t', '--timeout',
+                        type=float,
+                        default=3.0,
+                        help='timeout of a single query in seconds, default 3')
+
+    parser.add_argument('-r', '--retries',
+                        type=int,
+                        default=2,
+                        help='how many times a timed out query is retried on the next nameserver, default 2')
+
+    parser.add_argument('--cache-size',
+                        type=int,
+                        default=100_000,
+                        help='number of DNS answers kept in memory, default 100000')
+
+    parser.add_argument('--cache-file',
+                        type=str,
+                        help='file keeping the DNS answers between runs, answers are kept for their TTL')
+
+    parser.add_argument('--parent-zone',
+                        action='store_true',
+                        default=False,
+                        help='for names without own NS records report the nameservers of the enclosing zone')
+
     return parser.parse_args()
 
 
@@ -50,14 +270,54 @@ def logger_setup(cli_params: argparse.Namespace) -> None:
     logging.debug("CLI arguments: %s", pformat(cli_params))
 
 
-def get_domain_nameservers(domain: str) -> dict[str, str | list[str] | None]:
-    validators.domain(domain)
+async def resolve_ns(resolvers: ResolverPool,
+                     domain: str,
+                     retries: int) -> dns.resolver.Answer | None:
+    for attempt in range(retries + 1):
+        try:
+            return await resolvers.next().resolve(domain, 'NS')
+        except dns.exception.Timeout:
+            logging.debug("Query for %s timed out, attempt %d", domain, attempt + 1)
+
+    return None
+
+
+def get_enclosing_zone(err: dns.resolver.NoAnswer) -> str | None:
+    # the SOA in the authority section of the empty answer names the zone holding the name
+    response = err.response()  # pylint: disable=no-value-for-parameter
+    for rrset in response.authority if response else []:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return rrset.name.to_text(omit_final_dot=True)
+
+    return None
 
+
+async def get_domain_nameservers(resolvers: ResolverPool,
+                                 domain: str,
+                                 retries: int,
+                                 parent_zone: bool) -> dict[str, str | list[str] | None]:
     try:
-        dns_answers = dns.resolver.resolve(domain, 'NS')
+        dns_answers = await resolve_ns(resolvers, domain, retries)
+        if dns_answers is None:
+            logging.error("DNS query timed out for domain: %s", domain)
+            return {
+                'domain': domain,
+                'nameservers': "DNS query timed out"
+            }
+
     except (dns.resolver.NXDOMAIN,
             dns.resolver.NoNameservers,
             dns.resolver.NoAnswer) as err:
+        zone = get_enclosing_zone(err) if parent_zone and isinstance(err, dns.resolver.NoAnswer) else None
+        if zone and zone != domain.rstrip('.'):
+            # siblings share the zone, its NS records come from the cache after the first lookup
+            zone_data = await get_domain_nameservers(resolvers, zone, retries, parent_zone=False)
+            return {
+                'domain': domain,
+                'nameservers': zone_data['nameservers'],
+                'zone': zone
+            }
+
         logging.error("Domain does not exist: %s", domain)
 
         if isinstance(err, dns.resolver.NoAnswer):
@@ -74,6 +334,14 @@ def get_domain_nameservers(domain: str) -> dict[str, str | list[str] | None]:
             'nameservers': error_message
         }
 
+    except dns.exception.DNSException as err:
+        # malformed names like empty or too long labels fail only their own lookup
+        logging.error("DNS error for domain %s: %s", domain, str(err))
+        return {
+            'domain': domain,
+            'nameservers': f"DNS error for domain: {str(err)}"
+        }
+
     ns_fqdns = sorted({rdata.target.to_text(omit_final_dot=True) for rdata in dns_answers})
 
     logging.debug("DNS answers: %s", ns_fqdns)
@@ -84,12 +352,52 @@ def get_domain_nameservers(domain: str) -> dict[str, str | list[str] | None]:
     }
 
 
-def main(domains2check: list[str]) -> None:
-    logging.debug("Getting NS server details for domains: %s", pformat(domains2check))
+async def iter_domain_nameservers(domains2check: Iterable[str],
+                                  resolvers: ResolverPool,
+                                  cli_params: argparse.Namespace) -> AsyncIterator[dict[str, str | list[str] | None]]:
+    concurrency = cli_params.concurrency
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded_get_domain_nameservers(domain: str) -> dict[str, str | list[str] | None]:
+        async with semaphore:
+            return await get_domain_nameservers(resolvers, domain, cli_params.retries, cli_params.parent_zone)
+
+    window: deque[asyncio.Task] = deque()
+    for domain in domains2check:
+        window.append(asyncio.create_task(bounded_get_domain_nameservers(domain)))
+        if len(window) >= concurrency * ORDERED_WINDOW_FACTOR:
+            yield await window.popleft()
+
+    while window:
+        yield await window.popleft()
 
-    output_data = [get_domain_nameservers(item) for item in domains2check]
 
-    json.dump(output_data, sys.stdout, indent=4, ensure_ascii=True)
+async def write_domain_nameservers(domains2check: Iterable[str],
+                                   cli_params: argparse.Namespace) -> None:
+    cache = PersistentCache(cli_params.cache_size)
+    if cli_params.cache_file:
+        load_dns_cache(cache, cli_params.cache_file)
+
+    resolvers = ResolverPool(cli_params.nameserver, cli_params.port, cli_params.timeout, cache)
+
+    with JsonOutputWriter(sys.stdout, cli_params.output_format) as writer:
+        async for output_data in iter_domain_nameservers(domains2check, resolvers, cli_params):
+            writer.write(output_data)
+
+    logging.debug("DNS cache hits: %d, misses: %d", cache.hits(), cache.misses())
+
+    if cli_params.cache_file:
+        save_dns_cache(cache, cli_params.cache_file)
+
+
+def main(domains2check: Iterable[str], cli_params: argparse.Namespace) -> None:
+    logging.debug("Getting NS server details for domains")
+
+    if cli_params.concurrency < 1:
+        logging.error("Concurrency has to be a positive number, got: %d", cli_params.concurrency)
+        sys.exit(1)
+
+    asyncio.run(write_domain_nameservers(domains2check, cli_params))
 
 
 if __name__ == "__main__":
@@ -97,12 +405,4 @@ def main(domains2check: list[str]) -> None:
 
     logger_setup(args)
 
-    domains: list[str] = []
-    if args.domain:
-        domains.append(args.domain)
-    elif args.file:
-        with open(args.file, 'r', encoding='utf-8') as file:
-            domains = [line.strip() for line in file.read().splitlines()
-                       if line.strip() or line.strip().startswith('#') is False]
-
-    main(domains)
+    main([args.domain] if args.domain else read_domains(args.file), args)
@@ -3,12 +3,21 @@
 # pylint: disable=missing-function-docstring
 """
 generate JSON file with Google API IP addresses.
+
+The prefixes are treated as sets of addresses, so the output is the smallest exact list of prefixes
+of `goog - cloud - DNS + EXTRA_CIDRS`, with overlaps removed and adjacent prefixes merged.
+
+The feeds are kept in a local cache and requested again only conditionally, when neither feed
+changed upstream the output file is left alone.
 """
 import argparse
 import ipaddress
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, List
 
-from urllib.request import urlopen
+from urllib.request import Request, urlopen
 from urllib.error import HTTPError
 
 
@@ -17,56 +26,222 @@
     "cloud": "https://www.gstatic.com/ipranges/cloud.json",
 }
 
-DNS = ["8.8.4.0/24", "8.8.8.0/24"]
+FEED_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'gcp-ipranges.json')
 
-# source: https://cloud.google.com/vpc/docs/configure-private-google-access#config-options
-EXTRA_CIDRS = ["34.126.0.0/18", "199.36.153.8/30", "199.36.153.4/30"]
+HTTP_TIMEOUT = 30
 
+DNS = ["8.8.4.0/24", "8.8.8.0/24", "2001:4860:4860::8888/128", "2001:4860:4860::8844/128"]
+
+# source: https://cloud.google.com/vpc/docs/configure-private-google-access#config-options
+EXTRA_CIDRS = ["34.126.0.0/18", "199.36.153.8/30", "199.36.153.4/30",
+               "2600:2d00:2:2000::/64", "2600:2d00:2:1000::/64"]
+
+
+class AddressRangeSet:
+    """
+    set of IP addresses kept as sorted, disjoint and non-adjacent integer ranges per IP version
+    """
+    def __init__(self, ranges: dict[int, List[tuple[int, int]]] | None = None):
+        self.ranges = {version: self.merge(version_ranges) for version, version_ranges in (ranges or {}).items()}
+
+    @classmethod
+    def from_cidrs(cls, cidrs: Iterable[str]) -> 'AddressRangeSet':
+        ranges: dict[int, List[tuple[int, int]]] = {}
+        for cidr in cidrs:
+            network = ipaddress.ip_network(cidr)
+            ranges.setdefault(network.version, []).append((int(network.network_address),
+                                                          int(network.broadcast_address)))
+        return cls(ranges)
+
+    @staticmethod
+    def merge(ranges: Iterable[tuple[int, int]]) -> List[tuple[int, int]]:
+        merged: List[tuple[int, int]] = []
+        for first, last in sorted(ranges):
+            if merged and first <= merged[-1][1] + 1:
+                if last > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], last)
+            else:
+                merged.append((first, last))
+        return merged
+
+    def union(self, other: 'AddressRangeSet') -> 'AddressRangeSet':
+        return AddressRangeSet({version: self.ranges.get(version, []) + other.ranges.get(version, [])
+                                for version in self.ranges.keys() | other.ranges.keys()})
+
+    def difference(self, other: 'AddressRangeSet') -> 'AddressRangeSet':
+        result = {}
+        for version, ranges in self.ranges.items():
+            removed = other.ranges.get(version, [])
+            remaining = []
+            index = 0
+
+            # one sweep over both sorted lists
+            for first, last in ranges:
+                while index < len(removed) and removed[index][1] < first:
+                    index += 1
+
+                position = index
+                while position < len(removed) and removed[position][0] <= last:
+                    if removed[position][0] > first:
+                        remaining.append((first, removed[position][0] - 1))
+                    first = max(first, removed[position][1] + 1)
+                    position += 1
+
+                if first <= last:
+                    remaining.append((first, last))
+
+            result[version] = remaining
+
+        return AddressRangeSet(result)
+
+    def to_cidrs(self, versions: Iterable[int] = (4, 6)) -> List[str]:
+        """
+        minimal list of prefixes covering exactly the addresses of the set, IPv4 first, by address
+        """
+        address_classes = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+        return [str(network)
+                for version in versions
+                for first, last in self.ranges.get(version, [])
+                for network in ipaddress.summarize_address_range(address_classes[version](first),
+                                                                 address_classes[version](last))]
+
+
+def read_json_from_url(url: str, cached: dict[str, Any] | None = None) -> dict[str, Any]:
+    """
+    downloads the feed, or with a cached copy asks only for changes since then
+    :param url: feed URL
+    :param cached: cache entry of the feed from a previous run
+    :return: cache entry with the validators, the `syncToken` and `creationTime` of the feed and the feed itself
+    """
+    request = Request(url)
+    if cached:
+        if cached.get('etag'):
+            request.add_header('If-None-Match', cached['etag'])
+        if cached.get('last_modified'):
+            request.add_header('If-Modified-Since', cached['last_modified'])
 
-def read_json_from_url(url: str) -> dict:
     try:
-        return json.loads(urlopen(url).read())
-    except (IOError, HTTPError) as exc:
+        with urlopen(request, timeout=HTTP_TIMEOUT) as response:
+            data = json.loads(response.read())
+            headers = response.headers
+    except HTTPError as exc:
+        if exc.code == 304 and cached:
+            return cached
+        raise ValueError(f"Invalid HTTP response from {url}") from exc
+    except IOError as exc:
         raise ValueError(f"Invalid HTTP response from {url}") from exc
     except json.decoder.JSONDecodeError as exc:
         raise ValueError(f"Could not parse HTTP response from {url}") from exc
 
+    return {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'sync_token': data.get('syncToken'),
+        'creation_time': data.get('creationTime'),
+        'data': data,
+    }
+
+
+def read_feeds(cache: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    """
+    requests all the feeds at once, the cache entries of the feeds are replaced in place
+    """
+    feed_cache = cache.setdefault('feeds', {})
+
+    with ThreadPoolExecutor(max_workers=len(IPRANGE_URLS)) as executor:
+        entries = executor.map(lambda url: read_json_from_url(url, feed_cache.get(url)), IPRANGE_URLS.values())
+        feeds = dict(zip(IPRANGE_URLS, entries))
+
+    for group, src_url in IPRANGE_URLS.items():
+        feed_cache[src_url] = feeds[group]
+
+    return feeds
 
-def get_google_ipv4_prefixes(url: str):
-    data = read_json_from_url(url)
 
-    return [entry.get("ipv4Prefix")
-           for entry in data["prefixes"] if "ipv4Prefix" in entry]
+def load_feed_cache(cache_file: str) -> dict[str, Any]:
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as feed_cache_file:
+            return json.load(feed_cache_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        print(f"Cached feeds {cache_file} unusable, downloading again: {err}")
+        return {}
+
+
+def save_feed_cache(cache_file: str, cache: dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    temp_file = f"{cache_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as feed_cache_file:
+        json.dump(cache, feed_cache_file)
+    os.replace(temp_file, cache_file)
 
 
-def get_out_file_from_args() -> str:
+def get_google_prefixes(data: dict[str, Any]) -> List[str]:
+    return [entry.get(key)
+            for entry in data["prefixes"]
+            for key in ("ipv4Prefix", "ipv6Prefix") if key in entry]
+
+
+def get_cli_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
 
+    parser.add_argument('-6', '--ipv6',
+                        action='store_true',
+                        default=False,
+                        help='add IPv6 prefixes after the IPv4 ones')
+
+    parser.add_argument('--cache',
+                        default=FEED_CACHE_FILE,
+                        help=f"where the feeds are kept between runs, default {FEED_CACHE_FILE}, "
+                             f"empty to download them every time")
+
     parser.add_argument('out_file',
                         help='name of the JSON output file')
 
-    parsed_args = parser.parse_args()
-
-    return parsed_args.out_file
+    return parser.parse_args()
 
 
 def main():
-    cidrs_ipv4 = {
-        group: get_google_ipv4_prefixes(src_url)
-        for group, src_url in IPRANGE_URLS.items()
+    cli_arguments = get_cli_arguments()
+
+    cache = load_feed_cache(cli_arguments.cache) if cli_arguments.cache else {}
+    feeds = read_feeds(cache)
+
+    # what the output file was generated from, feeds without a syncToken count as changed every time
+    output_source = {
+        'feeds': {group: feed['sync_token'] or feed['etag'] for group, feed in feeds.items()},
+        'ipv6': cli_arguments.ipv6,
+    }
+    output_key = os.path.abspath(cli_arguments.out_file)
+    outputs = cache.setdefault('outputs', {})
+
+    if (all(output_source['feeds'].values()) and outputs.get(output_key) == output_source
+            and os.path.exists(cli_arguments.out_file)):
+        print(f"Feeds unchanged since {feeds['goog']['creation_time']}, {cli_arguments.out_file} is up to date")
+        if cli_arguments.cache:
+            save_feed_cache(cli_arguments.cache, cache)
+        return
+
+    cidrs = {
+        group: AddressRangeSet.from_cidrs(get_google_prefixes(feed['data']))
+        for group, feed in feeds.items()
     }
 
-    google_api_addresses = set(cidrs_ipv4["goog"])
-    google_api_addresses = google_api_addresses.difference(cidrs_ipv4["cloud"])
-    google_api_addresses = google_api_addresses.difference(DNS)
-    google_api_addresses.update(EXTRA_CIDRS)
+    google_api_addresses = (cidrs["goog"]
+                            .difference(cidrs["cloud"])
+                            .difference(AddressRangeSet.from_cidrs(DNS))
+                            .union(AddressRangeSet.from_cidrs(EXTRA_CIDRS)))
 
-    output_payload = sorted(list(google_api_addresses),
-                            key=lambda x: ipaddress.IPv4Network(x).network_address.packed)
+    output_payload = google_api_addresses.to_cidrs((4, 6) if cli_arguments.ipv6 else (4,))
 
-    with open(get_out_file_from_args(), 'w', encoding='utf-8') as out_file:
+    with open(cli_arguments.out_file, 'w', encoding='utf-8') as out_file:
         out_file.write(json.dumps(output_payload, indent=4))
 
+    if cli_arguments.cache:
+        outputs[output_key] = output_source
+        save_feed_cache(cli_arguments.cache, cache)
+
 
 if __name__ == "__main__":
     main()
@@ -3,61 +3,226 @@
 # pylint: disable=missing-function-docstring
 """
 get GitHub user ssh-keys and generate Mikrotik commands for adding them to the router.
+
+In batch mode the users come from a mapping file, their keys are fetched concurrently over one pooled
+client and the commands are combined into one script without duplicates. The keys are cached with
+their ETags, unchanged keys cost only a conditional request, which GitHub does not count against
+the rate limit.
+
+required ubuntu packages:
+    - python3-httpx
+optional:
+    - python3-h2, the requests share a single HTTP/2 connection
 """
 import argparse
+import asyncio
 import json
+import logging
+import os
+import sys
+from collections.abc import Iterable
+from typing import Any
 
 from string import Template
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError
+
+import httpx
+
+try:
+    import h2  # pylint: disable=unused-import
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
 
 GITHUB_API_BASE_URL = "https://api.github.com/users"
 
+GITHUB_API_HEADERS = {
+    'Accept': 'application/vnd.github+json',
+    'X-GitHub-Api-Version': '2022-11-28',
+}
+
+KEYS_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'github-keys.json')
+
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+CONCURRENCY = 10
+
 MT_ADD_KEY_COMMAND_TEMPLATE = Template("/user/ssh-keys/add user=${user} key=\"${key}\"")
 
-def read_keys_from_gh(user: str) -> list[str]:
+
+async def read_keys_from_gh(client: httpx.AsyncClient,
+                            user: str,
+                            cached: dict[str, Any] | None = None) -> dict[str, Any]:
+    """
+    reads the public keys of the user, with a cached copy only when they changed since then
+    :param client: HTTP client
+    :param user: GitHub user
+    :param cached: cache entry of the user from a previous run
+    :return: cache entry with the ETag and the keys
+    """
     github_api_url = f"{GITHUB_API_BASE_URL}/{user}/keys"
 
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+
     try:
-        with urlopen(Request(url=github_api_url,
-                             data=None,
-                             headers={
-                                 'Accept': 'application/vnd.github+json',
-                                 'X-GitHub-Api-Version': '2022-11-28'
-                             })) as response:
-            keys = json.loads(response.read())
-            return [key['key'] for key in keys]
-
-    except (IOError, HTTPError) as error:
+        response = await client.get(github_api_url, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached
+        response.raise_for_status()
+        keys = response.json()
+    except (httpx.HTTPError, ValueError) as error:
         raise ValueError(f"Invalid HTTP response from {github_api_url}") from error
 
+    return {
+        'etag': response.headers.get('ETag'),
+        'keys': [key['key'] for key in keys],
+    }
+
+
+async def read_all_keys(users: Iterable[str], cache: dict[str, Any], concurrency: int) -> dict[str, list[str] | None]:
+    """
+    reads the keys of all the users at once, the cache entries are replaced in place
+    :return: keys per user, None for the users whose keys could not be read
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=1 if HTTP2 else concurrency,
+                          max_keepalive_connections=1 if HTTP2 else concurrency)
+
+    async with httpx.AsyncClient(headers=GITHUB_API_HEADERS,
+                                 limits=limits,
+                                 timeout=HTTP_TIMEOUT,
+                                 http2=HTTP2) as client:
+        async def read(user: str) -> list[str] | None:
+            async with semaphore:
+                try:
+                    cache[user] = await read_keys_from_gh(client, user, cache.get(user))
+                except ValueError as error:
+                    logging.warning("Keys of %s not read: %s", user, str(error.__cause__ or error))
+                    return None
+            return cache[user]['keys']
+
+        users = list(dict.fromkeys(users))
+        results = await asyncio.gather(*(read(user) for user in users))
+
+    return dict(zip(users, results))
+
+
+def read_user_mapping(file_name: str) -> list[tuple[str, str]]:
+    """
+    reads `github_user mikrotik_user` pairs, one per line, the Mikrotik user defaults to the GitHub one
+    """
+    mapping = []
+    with open(file_name, 'r', encoding='utf-8') as mapping_file:
+        for line in mapping_file:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) > 2:
+                raise ValueError(f"Invalid line in {file_name}: {line.strip()}")
+            mapping.append((fields[0], fields[-1]))
+    return mapping
+
+
+def load_keys_cache(cache_file: str) -> dict[str, Any]:
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as keys_cache_file:
+            return json.load(keys_cache_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        logging.warning("Cached keys %s unusable: %s", cache_file, str(err))
+        return {}
+
 
-def get_users_from_args() -> (str, str):
+def save_keys_cache(cache_file: str, cache: dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    temp_file = f"{cache_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as keys_cache_file:
+        json.dump(cache, keys_cache_file)
+    os.replace(temp_file, cache_file)
+
+
+def get_cli_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
 
+    parser.add_argument('-v',
+                        '--verbose',
+                        action='store_true',
+                        default=False,
+                        help='talkative mode')
+
     parser.add_argument('github_user',
+                        nargs='?',
                         help='GitHub user to read SSH-keys for')
 
     parser.add_argument('mikrotik_user',
+                        nargs='?',
                         help='Mikrotik user to add SSH-keys for')
 
+    parser.add_argument('-m', '--mapping',
+                        help='file with `github_user mikrotik_user` pairs, one per line, instead of a single pair')
+
+    parser.add_argument('-c', '--concurrency',
+                        type=int,
+                        default=CONCURRENCY,
+                        help=f"GitHub requests in flight, default {CONCURRENCY}")
+
+    parser.add_argument('--cache',
+                        help=f"where the keys are kept with their ETags between runs, with --mapping "
+                             f"default {KEYS_CACHE_FILE}, otherwise no cache, empty to download them every time")
+
     parsed_args = parser.parse_args()
 
-    return parsed_args.github_user, parsed_args.mikrotik_user
+    if bool(parsed_args.mapping) == bool(parsed_args.github_user and parsed_args.mikrotik_user):
+        parser.error('either both github_user and mikrotik_user, or --mapping is required')
+
+    if parsed_args.concurrency < 1:
+        parser.error(f"concurrency has to be a positive number, got: {parsed_args.concurrency}")
+
+    # a single pair keeps working without side effects, only the batch mode caches by default
+    if parsed_args.cache is None:
+        parsed_args.cache = KEYS_CACHE_FILE if parsed_args.mapping else ''
+
+    return parsed_args
 
 
 def main():
-    github_user, mikrotik_user = get_users_from_args()
+    cli_arguments = get_cli_arguments()
 
-    keys = read_keys_from_gh(github_user)
+    if cli_arguments.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    if cli_arguments.mapping:
+        mapping = read_user_mapping(cli_arguments.mapping)
+    else:
+        mapping = [(cli_arguments.github_user, cli_arguments.mikrotik_user)]
+
+    cache = load_keys_cache(cli_arguments.cache) if cli_arguments.cache else {}
+    keys = asyncio.run(read_all_keys((github_user for github_user, _ in mapping), cache, cli_arguments.concurrency))
+    if cli_arguments.cache:
+        save_keys_cache(cli_arguments.cache, cache)
 
     print("# beginning of the Mikrotik commands")
 
-    for key in keys:
-        print(MT_ADD_KEY_COMMAND_TEMPLATE.substitute(user=mikrotik_user, key=key))
+    # the same key for the same Mikrotik user is added once, even when it comes from more GitHub users
+    commands_seen = set()
+    for github_user, mikrotik_user in mapping:
+        for key in keys[github_user] or []:
+            command = MT_ADD_KEY_COMMAND_TEMPLATE.substitute(user=mikrotik_user, key=key)
+            if command not in commands_seen:
+                commands_seen.add(command)
+                print(command)
 
     print("# end of the Mikrotik commands")
 
+    failed_users = [github_user for github_user, user_keys in keys.items() if user_keys is None]
+    if failed_users:
+        logging.error("Keys not read for: %s", ', '.join(failed_users))
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
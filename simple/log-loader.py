@@ -9,30 +9,661 @@
     python log-loader.py [-d <syslog server ip>:<port>] <log_file>
 """
 import argparse
-import logging
-import logging.handlers
+import bz2
+import gzip
+import json
+import lzma
+import mmap
+import multiprocessing
+import os
+import re
+import queue
 import socket
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from datetime import datetime
 from typing import List
 
 from tqdm import tqdm
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 SYSLOG_SERVER = ('127.0.0.1', 2514)
 
-def forward_log_entries(log_file_path: str, logger: logging.Logger) -> None:
+# facility user, severity info - the priority SysLogHandler used to put in front of every line
+SYSLOG_PRIORITY = b'<14>'
+
+# lines handed to the sender at once
+BATCH_SIZE = 1000
+
+# input is split into lines in blocks of this size
+BLOCK_SIZE = 1024 * 1024
+
+COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+    '.zst': lambda file_name: zstandard.open(file_name, 'rb'),
+}
+
+DELIVERY_STATS = ('sent', 'bytes', 'failed', 'retried', 'reconnects', 'spilled')
+
+# batches waiting for the sender before the reading is held back or spilled to disk
+QUEUE_SIZE = 100
+
+MAX_RETRIES = 10
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+# larger datagrams cannot be sent over UDP at all
+MAX_UDP_PAYLOAD = 65507
+
+# paced sending goes out in batches worth this many seconds, so the stream stays smooth
+PACING_TICK = 0.01
+
+# only used to size the batches when pacing by bytes per second
+ASSUMED_LINE_LENGTH = 200
+
+# timestamps are looked for only at the beginning of the line
+TIMESTAMP_SEARCH_LENGTH = 160
+
+TIMESTAMP_PATTERNS = [
+    # FortiGate key=value logs
+    (re.compile(rb'date=(\d{4}-\d{2}-\d{2}) time=(\d{2}:\d{2}:\d{2})'),
+     lambda match: datetime.fromisoformat(f"{match[1].decode()} {match[2].decode()}")),
+    # ISO 8601, RFC 5424 syslog
+    (re.compile(rb'(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?)'),
+     lambda match: datetime.fromisoformat(match[1].decode())),
+    # RFC 3164 syslog, without a year - a leap one is assumed so Feb 29 parses
+    (re.compile(rb'([A-Z][a-z]{2} [ \d]\d \d{2}:\d{2}:\d{2})'),
+     lambda match: datetime.strptime(f"2000 {match[1].decode()}", '%Y %b %d %H:%M:%S')),
+]
+
+
+class SyslogSender:  # pylint: disable=too-many-instance-attributes
+    """
+    sends log lines to the syslog server without the logging machinery
+
+    TCP frames are octet-counted (RFC 6587) and a whole batch goes out in one `sendall`,
+    UDP uses a connected socket and one datagram per line (RFC 5426). The datagrams of a batch go out
+    in a tight loop of `send` calls, one per datagram, as Python's socket module has no `sendmmsg`.
+
+    Batches are sent from a background thread fed through a bounded queue. A broken TCP connection
+    is re-established with an exponential backoff and the batch is sent again, so a restarting
+    collector delays the replay instead of losing lines. Once a batch runs out of retries the server
+    is taken as down, the next batches get a single attempt each until it answers again.
+    When the queue is full the reading waits, or with a spill file the batches which do not fit
+    are parked on disk and sent at the end, paced like the rest.
+    Every line ends up counted as either sent or failed.
+    """
+    def __init__(self,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                 syslog_server: str,
+                 syslog_port: int,
+                 syslog_protocol: str,
+                 queue_size: int = QUEUE_SIZE,
+                 max_retries: int = MAX_RETRIES,
+                 spill_file: str | None = None,
+                 pacer: 'Pacer | None' = None):
+        self.tcp = syslog_protocol == 'tcp'
+        self.address = (syslog_server, syslog_port)
+        self.max_retries = max_retries
+        self.server_down = False
+        self.spill_file = spill_file
+        self.spill = None
+        self.pacer = pacer
+        self.stats: Counter = Counter()
+        self.start = time.monotonic()
+        self.sock: socket.socket | None = None
+
+        if not self.tcp:
+            family, socktype, proto, _, address = socket.getaddrinfo(syslog_server, syslog_port,
+                                                                     type=socket.SOCK_DGRAM)[0]
+            # connected once, so the address is not resolved again for every datagram
+            self.sock = socket.socket(family, socktype, proto)
+            self.sock.connect(address)
+
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self) -> 'SyslogSender':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def send_batch(self, lines: List[bytes]) -> None:
+        try:
+            self.queue.put_nowait(lines)
+            return
+        except queue.Full:
+            if not self.spill_file:
+                self.queue.put(lines)
+                return
+
+        # only the batches which do not fit go to disk, the queue is tried first again for the next one
+        if self.spill is None:
+            print(f"Sending falls behind, spilling lines to {self.spill_file}.")
+            # pylint: disable-next=consider-using-with
+            self.spill = open(self.spill_file, 'wb')
+
+        self.spill.write(b'\n'.join(lines))
+        self.spill.write(b'\n')
+        self.stats['spilled'] += len(lines)
+
+    def run(self) -> None:
+        while (batch := self.queue.get()) is not None:
+            self.deliver(batch)
+            self.queue.task_done()
+
+    def flush(self) -> None:
+        self.queue.join()
+
+    def deliver(self, lines: List[bytes]) -> None:
+        if self.tcp:
+            self.deliver_tcp(lines)
+            return
+
+        send = self.sock.send
+        failed = sent_bytes = 0
+        for line in lines:
+            datagram = (SYSLOG_PRIORITY + line)[:MAX_UDP_PAYLOAD]
+            try:
+                send(datagram)
+                # a truncated line counts only with the part which went out
+                sent_bytes += len(datagram) - len(SYSLOG_PRIORITY)
+            except OSError:
+                # ICMP port unreachable for an earlier datagram or no buffer space, the line is gone
+                failed += 1
+
+        self.stats['sent'] += len(lines) - failed
+        self.stats['bytes'] += sent_bytes
+        self.stats['failed'] += failed
+
+    def deliver_tcp(self, lines: List[bytes]) -> None:
+        payload = b''.join(b'%d %s%s' % (len(SYSLOG_PRIORITY) + len(line), SYSLOG_PRIORITY, line)
+                           for line in lines)
+
+        # a server which is down costs every batch a single attempt, not the whole backoff
+        max_retries = 0 if self.server_down else self.max_retries
+
+        for attempt in range(max_retries + 1):
+            try:
+                if self.sock is None:
+                    self.sock = socket.create_connection(self.address)
+                    if attempt or self.server_down:
+                        self.stats['reconnects'] += 1
+                self.sock.sendall(payload)
+                self.stats['sent'] += len(lines)
+                self.stats['bytes'] += sum(len(line) for line in lines)
+                if self.server_down:
+                    print(f"Sending to {self.address[0]}:{self.address[1]} works again.")
+                    self.server_down = False
+                return
+            except OSError as err:
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+
+                if attempt < max_retries:
+                    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+                    print(f"Sending to {self.address[0]}:{self.address[1]} failed ({err}), retrying in {delay:.1f}s.")
+                    # frames of the batch which made it before the failure get sent again
+                    self.stats['retried'] += len(lines)
+                    time.sleep(delay)
+
+        if not self.server_down:
+            print(f"Sending to {self.address[0]}:{self.address[1]} failed {self.max_retries + 1} times, "
+                  f"the next batches get a single attempt until it works again.")
+            self.server_down = True
+
+        self.stats['failed'] += len(lines)
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.spill is not None:
+            self.spill.close()
+            for batch in read_batches(self.spill_file, self.pacer.batch_size if self.pacer else BATCH_SIZE):
+                if self.pacer:
+                    self.pacer.wait(batch)
+                self.deliver(batch)
+            os.remove(self.spill_file)
+
+        if self.sock is not None:
+            self.sock.close()
+
+        self.stats['elapsed'] = time.monotonic() - self.start
+
+
+def format_delivery_report(stats: Counter) -> str:
+    elapsed = max(stats['elapsed'], 1e-9)
+
+    return (f"Sent {stats['sent']} lines ({stats['bytes'] / 1e6:.1f} MB), failed {stats['failed']}, "
+            f"retried {stats['retried']}, reconnects {stats['reconnects']}, spilled {stats['spilled']}, "
+            f"in {stats['elapsed']:.1f}s ({stats['sent'] / elapsed:.0f} lines/s, "
+            f"{stats['bytes'] / elapsed / 1e6:.1f} MB/s).")
+
+
+class Pacer:  # pylint: disable=too-few-public-methods
+    """
+    keeps sending at a fixed target rate of lines and/or bytes per second
+
+    The schedule is counted from the start, so oversleeping in one batch does not add up to a drift.
+    """
+    def __init__(self, lines_per_second: float | None, bytes_per_second: float | None):
+        self.lines_per_second = lines_per_second
+        self.bytes_per_second = bytes_per_second
+        self.start: float | None = None
+        self.lines = 0
+        self.bytes = 0
+
+        batch_sizes = [BATCH_SIZE]
+        if lines_per_second:
+            batch_sizes.append(int(lines_per_second * PACING_TICK))
+        if bytes_per_second:
+            batch_sizes.append(int(bytes_per_second * PACING_TICK / ASSUMED_LINE_LENGTH))
+        self.batch_size = max(1, min(batch_sizes))
+
+    def wait(self, batch: List[bytes]) -> None:
+        if self.start is None:
+            self.start = time.monotonic()
+
+        due = max(self.lines / self.lines_per_second if self.lines_per_second else 0.0,
+                  self.bytes / self.bytes_per_second if self.bytes_per_second else 0.0)
+        delay = self.start + due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        self.lines += len(batch)
+        self.bytes += sum(len(line) for line in batch)
+
+
+class ReplayClock:  # pylint: disable=too-few-public-methods
+    """
+    reproduces the original spacing of the log lines, `speedup` times faster
+    """
+    def __init__(self, speedup: float):
+        self.speedup = speedup
+        self.first_timestamp: float | None = None
+        self.start = 0.0
+
+    def wait(self, timestamp: float | None) -> None:
+        if timestamp is None:
+            return
+
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+            self.start = time.monotonic()
+            return
+
+        delay = self.start + (timestamp - self.first_timestamp) / self.speedup - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_timestamp(line: bytes) -> float | None:
+    for pattern, converter in TIMESTAMP_PATTERNS:
+        match = pattern.search(line, 0, TIMESTAMP_SEARCH_LENGTH)
+        if match:
+            try:
+                return converter(match).timestamp()
+            except ValueError:
+                continue
+
+    return None
+
+
+def is_compressed(log_file_path: str) -> bool:
+    return os.path.splitext(log_file_path)[1].lower() in COMPRESSED_OPENERS
+
+
+def split_block(block: bytes) -> List[bytes]:
+    lines = block.split(b'\n')
+    if b'\r' in block:
+        lines = [line[:-1] if line.endswith(b'\r') else line for line in lines]
+
+    return lines
+
+
+def read_compressed_line_blocks(log_file_path: str) -> Iterator[List[bytes]]:
+    opener = COMPRESSED_OPENERS[os.path.splitext(log_file_path)[1].lower()]
+
+    with opener(log_file_path) as log_file:
+        remainder = b''
+        while block := log_file.read(BLOCK_SIZE):
+            block = remainder + block
+            cut = block.rfind(b'\n')
+            if cut == -1:
+                remainder = block
+                continue
+
+            remainder = block[cut + 1:]
+            yield split_block(block[:cut])
+
+        if remainder:
+            yield split_block(remainder)
+
+
+def read_line_blocks(log_file_path: str, start: int = 0, end: int | None = None) -> Iterator[List[bytes]]:
+    """
+    lists of lines without line endings, split from large blocks of bytes instead of line by line
+    """
+    if is_compressed(log_file_path):
+        yield from read_compressed_line_blocks(log_file_path)
+        return
+
+    with open(log_file_path, 'rb') as log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as log_map:
+            position = start
+            while position < end:
+                cut = log_map.rfind(b'\n', position, min(position + BLOCK_SIZE, end))
+                if cut == -1:
+                    # a line longer than the block, or the last one without a line ending
+                    cut = log_map.find(b'\n', position, end)
+                    if cut == -1:
+                        cut = end
+
+                yield split_block(log_map[position:cut])
+                position = cut + 1
+
+
+def read_batches(log_file_path: str,
+                 batch_size: int,
+                 start: int = 0,
+                 end: int | None = None) -> Iterator[List[bytes]]:
+    for block in read_line_blocks(log_file_path, start, end):
+        for position in range(0, len(block), batch_size):
+            yield block[position:position + batch_size]
+
+
+def split_file(log_file_path: str, parts: int) -> List[tuple[int, int]]:
+    """
+    byte ranges of roughly equal size, every one starting at the beginning of a line
+    """
+    size = os.path.getsize(log_file_path)
+    offsets = [0]
+
+    with open(log_file_path, 'rb') as log_file:
+        for part in range(1, parts):
+            log_file.seek(max(size * part // parts, offsets[-1]))
+            log_file.readline()
+            offsets.append(min(log_file.tell(), size))
+
+    offsets.append(size)
+
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+def read_timed_batches(log_file_path: str, batch_size: int) -> Iterator[tuple[float | None, List[bytes]]]:
+    """
+    batches of consecutive lines sharing the timestamp of the first one,
+    lines without a recognised timestamp stay with the preceding ones
+    """
+    batch_timestamp = None
+    batch: List[bytes] = []
+    for block in read_line_blocks(log_file_path):
+        for line in block:
+            timestamp = parse_timestamp(line)
+            if batch and (len(batch) >= batch_size or (timestamp is not None and timestamp != batch_timestamp)):
+                yield batch_timestamp, batch
+                batch = []
+
+            if not batch:
+                batch_timestamp = timestamp
+            batch.append(line)
+
+    if batch:
+        yield batch_timestamp, batch
+
+
+def forward_log_entries(log_file_path: str,
+                        sender: SyslogSender,
+                        pacer: Pacer | None = None,
+                        replay_clock: ReplayClock | None = None) -> None:
+    batch_size = pacer.batch_size if pacer else BATCH_SIZE
+
+    if replay_clock:
+        batches = read_timed_batches(log_file_path, batch_size)
+    else:
+        batches = ((None, batch) for batch in read_batches(log_file_path, batch_size))
+
+    try:
+        with tqdm(unit=' lines') as progress:
+            for timestamp, batch in batches:
+                if replay_clock:
+                    replay_clock.wait(timestamp)
+                if pacer:
+                    pacer.wait(batch)
+
+                sender.send_batch(batch)
+                progress.update(len(batch))
+    except FileNotFoundError:
+        print(f"File {log_file_path} not found.")
+
+def load_follow_state(state_file: str | None) -> dict:
+    if not state_file:
+        return {}
+
+    try:
+        with open(state_file, 'r', encoding='utf-8') as state:
+            return json.load(state)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        print(f"Ignoring unusable state file {state_file}: {err}")
+        return {}
+
+
+def save_follow_state(state_file: str | None, inode: int, offset: int) -> None:
+    if not state_file:
+        return
+
+    temp_file = f"{state_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as state:
+        json.dump({'inode': inode, 'offset': offset}, state)
+    os.replace(temp_file, state_file)
+
+
+def is_rotated(log_file_path: str, inode: int) -> bool:
+    try:
+        return os.stat(log_file_path).st_ino != inode
+    except FileNotFoundError:
+        return True
+
+
+def send_lines(lines: List[bytes], sender: SyslogSender, pacer: Pacer | None, progress: tqdm) -> None:
+    batch_size = pacer.batch_size if pacer else BATCH_SIZE
+
+    for position in range(0, len(lines), batch_size):
+        batch = lines[position:position + batch_size]
+        if pacer:
+            pacer.wait(batch)
+        sender.send_batch(batch)
+        progress.update(len(batch))
+
+
+def follow_log_entries(log_file_path: str,
+                       sender: SyslogSender,
+                       pacer: Pacer | None,
+                       state_file: str | None,
+                       poll_interval: float) -> None:
+    """
+    forwards the file and then the lines appended to it, following rotation and truncation
+
+    The read offset is saved after every sent batch, so a restart neither resends nor skips lines.
+    A rotated file is read to its end before the new one is opened.
+    """
+    state = load_follow_state(state_file)
+    log_file = None
+    inode = offset = 0
+
+    with tqdm(unit=' lines') as progress:
+        try:
+            while True:
+                if log_file is None:
+                    try:
+                        log_file = open(log_file_path, 'rb')  # pylint: disable=consider-using-with
+                    except FileNotFoundError:
+                        time.sleep(poll_interval)
+                        continue
+
+                    inode = os.fstat(log_file.fileno()).st_ino
+                    offset = state.get('offset', 0) if state.get('inode') == inode else 0
+                    state = {}
+
+                if os.fstat(log_file.fileno()).st_size < offset:
+                    print(f"File {log_file_path} truncated, reading from the beginning.")
+                    offset = 0
+
+                block = os.pread(log_file.fileno(), BLOCK_SIZE, offset)
+                cut = block.rfind(b'\n')
+                # the line ending after the sent lines is skipped too
+                consumed = cut + 1
+                if cut == -1 and len(block) == BLOCK_SIZE:
+                    # a line longer than the block is sent in pieces, there is no line ending to skip
+                    cut = consumed = len(block)
+
+                if cut == -1 and is_rotated(log_file_path, inode):
+                    # the old file will not grow anymore, its last line does not need a line ending
+                    if block:
+                        sender.send_batch(split_block(block))
+                        progress.update(1)
+                    log_file.close()
+                    log_file = None
+                    continue
+
+                if cut == -1:
+                    time.sleep(poll_interval)
+                    continue
+
+                send_lines(split_block(block[:cut]), sender, pacer, progress)
+                offset += consumed
+                # the offset is saved only once the lines are out of the queue
+                sender.flush()
+                save_follow_state(state_file, inode, offset)
+
+        except KeyboardInterrupt:
+            print(f"Stopped following {log_file_path} at offset {offset}.")
+
+        finally:
+            if log_file is not None:
+                log_file.close()
+
+
+def forward_log_range(log_file_path: str,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                      file_range: tuple[int, int],
+                      destination: tuple[str, int],
+                      sender_options: dict,
+                      rates: tuple[float | None, float | None],
+                      shared_counters: tuple,
+                      worker: int) -> None:
+    """
+    worker process streaming one byte range of the file over its own connection
+    """
+    lines_read, delivery_stats = shared_counters
+    pacer = Pacer(*rates) if any(rates) else None
+
+    with SyslogSender(*destination, pacer=pacer, **sender_options) as sender:
+        for batch in read_batches(log_file_path, pacer.batch_size if pacer else BATCH_SIZE, *file_range):
+            if pacer:
+                pacer.wait(batch)
+
+            sender.send_batch(batch)
+            lines_read[worker] += len(batch)
+
+    for position, key in enumerate(DELIVERY_STATS):
+        delivery_stats[worker * len(DELIVERY_STATS) + position] = int(sender.stats[key])
+
+
+def forward_log_entries_parallel(log_file_path: str,  # pylint: disable=too-many-locals
+                                 destinations: List[tuple[str, int]],
+                                 sender_options: dict,
+                                 workers: int,
+                                 rates: tuple[float | None, float | None]) -> None:
     try:
-        with open(log_file_path, 'r', encoding='utf-8') as log_file:
-            for line in tqdm(log_file):
-                logger.info(line.strip())
+        file_ranges = split_file(log_file_path, workers)
     except FileNotFoundError:
         print(f"File {log_file_path} not found.")
+        return
+
+    # the target rate is shared by all the workers
+    worker_rates = tuple(rate / len(file_ranges) if rate else None for rate in rates)
+
+    # every worker updates only its own slots, no locking needed
+    lines_read = multiprocessing.Array('q', len(file_ranges), lock=False)
+    delivery_stats = multiprocessing.Array('q', len(file_ranges) * len(DELIVERY_STATS), lock=False)
+
+    processes = []
+    for worker, file_range in enumerate(file_ranges):
+        worker_options = dict(sender_options)
+        if worker_options.get('spill_file'):
+            worker_options['spill_file'] = f"{worker_options['spill_file']}.{worker}"
+
+        processes.append(multiprocessing.Process(target=forward_log_range,
+                                                 args=(log_file_path, file_range,
+                                                       destinations[worker % len(destinations)],
+                                                       worker_options, worker_rates,
+                                                       (lines_read, delivery_stats), worker)))
+
+    start = time.monotonic()
+    for process in processes:
+        process.start()
+
+    with tqdm(unit=' lines') as progress:
+        while any(process.is_alive() for process in processes):
+            time.sleep(0.2)
+            progress.update(sum(lines_read) - progress.n)
+        progress.update(sum(lines_read) - progress.n)
+
+    stats: Counter = Counter()
+    for worker, process in enumerate(processes):
+        process.join()
+        if process.exitcode:
+            print(f"Worker {worker} failed with exit code {process.exitcode}.")
+
+        for position, key in enumerate(DELIVERY_STATS):
+            stats[key] += delivery_stats[worker * len(DELIVERY_STATS) + position]
+
+    stats['elapsed'] = time.monotonic() - start
+
+    print(f"{format_delivery_report(stats)} Workers: {len(processes)}.")
+
+
+def parse_destination(destination: str) -> tuple[str, int]:
+    syslog_server, syslog_port = destination.rsplit(':', 1)
+
+    return syslog_server, int(syslog_port)
+
 
 def cli_argument_parser(argument_list: List[str] | None) -> argparse.Namespace:
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-d',
                         '--destination',
-                        default=':'.join(str(i) for i in SYSLOG_SERVER),
-                        help='destination for the logs in format <syslog server ip>:<port>')
+                        action='append',
+                        help='destination for the logs in format <syslog server ip>:<port>, '
+                             'can be repeated to spread the workers over several servers, '
+                             f"default {':'.join(str(i) for i in SYSLOG_SERVER)}")
+
+    parser.add_argument('-w',
+                        '--workers',
+                        type=int,
+                        default=1,
+                        help='number of worker processes, each sending a part of the file over its own '
+                             'connection, at least one per destination, default 1')
 
     parser.add_argument('-p',
                         '--protocol',
@@ -40,35 +671,125 @@ def cli_argument_parser(argument_list: List[str] | None) -> argparse.Namespace:
                         choices=['udp', 'tcp'],
                         help='syslog connection type, udp or tcp')
 
+    parser.add_argument('-r',
+                        '--rate',
+                        type=float,
+                        help='target rate in lines per second, unlimited if not set')
+
+    parser.add_argument('-b',
+                        '--byte-rate',
+                        type=float,
+                        help='target rate in bytes per second, unlimited if not set')
+
+    parser.add_argument('--replay',
+                        action='store_true',
+                        default=False,
+                        help='keep the original spacing of the lines, based on their timestamps')
+
+    parser.add_argument('--speedup',
+                        type=float,
+                        default=1.0,
+                        help='how many times faster than the original the lines are replayed, default 1')
+
+    parser.add_argument('-f',
+                        '--follow',
+                        action='store_true',
+                        default=False,
+                        help='keep forwarding lines appended to the file, following its rotation and truncation')
+
+    parser.add_argument('--state-file',
+                        help='file keeping the read offset of --follow mode between restarts')
+
+    parser.add_argument('--poll-interval',
+                        type=float,
+                        default=0.5,
+                        help='seconds between checks for new data in --follow mode, default 0.5')
+
+    parser.add_argument('--queue-size',
+                        type=int,
+                        default=QUEUE_SIZE,
+                        help=f"batches of {BATCH_SIZE} lines waiting for the sender before the reading is held back, "
+                             f"default {QUEUE_SIZE}")
+
+    parser.add_argument('--max-retries',
+                        type=int,
+                        default=MAX_RETRIES,
+                        help=f"TCP reconnect attempts for a batch before its lines are counted as failed, "
+                             f"default {MAX_RETRIES}")
+
+    parser.add_argument('--spill-file',
+                        help='instead of holding the reading back, park the lines on disk when the sender falls '
+                             'behind, they are sent at the end, out of the original order')
+
     parser.add_argument('log_file',
-                        help='log file to load')
+                        help='log file to load, .gz, .bz2, .xz and .zst files are decompressed on the fly')
 
     cli_parameters = parser.parse_args(argument_list)
 
-    return cli_parameters
+    cli_parameters.destination = cli_parameters.destination or [':'.join(str(i) for i in SYSLOG_SERVER)]
+    cli_parameters.workers = max(cli_parameters.workers, len(cli_parameters.destination))
+
+    if cli_parameters.rate is not None and cli_parameters.rate <= 0:
+        parser.error(f"--rate has to be a positive number, got: {cli_parameters.rate}")
+
+    if cli_parameters.byte_rate is not None and cli_parameters.byte_rate <= 0:
+        parser.error(f"--byte-rate has to be a positive number, got: {cli_parameters.byte_rate}")
 
-def logger_config(syslog_server: str, syslog_port: int, syslog_protocol: str) -> logging.Logger:
-    logger = logging.getLogger('log_forwarder')
-    logger.setLevel(logging.INFO)
+    if cli_parameters.speedup <= 0:
+        parser.error(f"--speedup has to be a positive number, got: {cli_parameters.speedup}")
 
-    syslog_handler = logging.handlers.SysLogHandler(
-        address=(syslog_server, syslog_port),
-        socktype=socket.SOCK_STREAM if syslog_protocol=='tcp' else socket.SOCK_DGRAM
-    )
+    if cli_parameters.replay and cli_parameters.workers > 1:
+        parser.error('--replay keeps the order of the lines, it works with a single worker and destination only')
 
-    formatter = logging.Formatter('%(message)s\n')
-    syslog_handler.setFormatter(formatter)
+    if cli_parameters.follow and (cli_parameters.workers > 1
+                                  or cli_parameters.replay
+                                  or is_compressed(cli_parameters.log_file)):
+        parser.error('--follow works with a single worker and destination, on uncompressed files, without --replay')
 
-    logger.addHandler(syslog_handler)
+    if cli_parameters.follow and cli_parameters.spill_file:
+        parser.error('--follow confirms every block as delivered, it does not work with --spill-file')
 
-    return logger
+    if is_compressed(cli_parameters.log_file) and cli_parameters.workers > 1:
+        parser.error('compressed files cannot be split, they work with a single worker and destination only')
+
+    if cli_parameters.log_file.lower().endswith('.zst') and zstandard is None:
+        parser.error('reading .zst files requires the zstandard module (python3-zstandard package)')
+
+    return cli_parameters
 
 if __name__ == "__main__":
     params = cli_argument_parser(None)
-    dest_syslog_server, dest_syslog_port = params.destination.split(':')
+    syslog_destinations = [parse_destination(item) for item in params.destination]
 
     print(f"Loading logs from {params.log_file} to syslog server "
-          f"at {dest_syslog_server}:{int(dest_syslog_port)} using {params.protocol} protocol...")
+          f"at {', '.join(params.destination)} using {params.protocol} protocol...")
+
+    syslog_sender_options = {
+        'syslog_protocol': params.protocol,
+        'queue_size': params.queue_size,
+        'max_retries': params.max_retries,
+        'spill_file': params.spill_file,
+    }
 
-    forward_log_entries(params.log_file,
-                        logger_config(dest_syslog_server, int(dest_syslog_port), params.protocol))
+    if params.workers > 1:
+        forward_log_entries_parallel(params.log_file,
+                                     syslog_destinations,
+                                     syslog_sender_options,
+                                     params.workers,
+                                     (params.rate, params.byte_rate))
+    elif params.follow:
+        with SyslogSender(*syslog_destinations[0], **syslog_sender_options) as syslog_sender:
+            follow_log_entries(params.log_file,
+                               syslog_sender,
+                               Pacer(params.rate, params.byte_rate) if params.rate or params.byte_rate else None,
+                               params.state_file,
+                               params.poll_interval)
+        print(format_delivery_report(syslog_sender.stats))
+    else:
+        log_pacer = Pacer(params.rate, params.byte_rate) if params.rate or params.byte_rate else None
+        with SyslogSender(*syslog_destinations[0], pacer=log_pacer, **syslog_sender_options) as syslog_sender:
+            forward_log_entries(params.log_file,
+                                syslog_sender,
+                                log_pacer,
+                                ReplayClock(params.speedup) if params.replay else None)
+        print(format_delivery_report(syslog_sender.stats))
@@ -9,16 +9,178 @@
     - python3-httpx
 """
 import argparse
+import asyncio
+import hashlib
 import json
 import logging
+import os
 import sys
 import time
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator, Iterable, Iterator
+from contextlib import asynccontextmanager
 from pprint import pformat
-from typing import Any
+from typing import Any, TextIO
 
 import httpx
 import validators
 
+RDAP_REDIRECTOR_URL = 'https://rdap.org'
+
+IANA_BOOTSTRAP_URL = 'https://data.iana.org/rdap/dns.json'
+
+BOOTSTRAP_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'rdap-dns.json')
+
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+MAX_RETRIES = 3
+
+# how many finished lookups may wait behind a slow one when output keeps input order
+ORDERED_WINDOW_FACTOR = 4
+
+
+def read_domains(file_name: str) -> Iterator[str]:
+    """
+    lazily yields domains from the file, one per line, skipping blank lines, comments and duplicates
+    :param file_name: path to the file with domains
+    :return: iterator of unique domains in input order
+    """
+    # 8-byte digests instead of the names themselves keep the memory of seen domains small
+    seen: set[bytes] = set()
+    duplicates = 0
+
+    with open(file_name, 'r', encoding='utf-8') as file:
+        for line in file:
+            domain = line.strip()
+            if not domain or domain.startswith('#'):
+                continue
+
+            digest = hashlib.blake2b(domain.rstrip('.').lower().encode('utf-8'), digest_size=8).digest()
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+
+            yield domain
+
+    logging.debug("Domains read from %s: %d, duplicates skipped: %d", file_name, len(seen), duplicates)
+
+
+class JsonOutputWriter:
+    """
+    writes records one by one, either as NDJSON lines flushed right away or as an indented JSON array
+    identical to `json.dump(records, indent=4)`
+    """
+    def __init__(self, output: TextIO, output_format: str):
+        self.output = output
+        self.ndjson = output_format == 'ndjson'
+        self.count = 0
+
+    def __enter__(self) -> 'JsonOutputWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, record: dict[str, Any]) -> None:
+        if self.ndjson:
+            self.output.write(json.dumps(record, ensure_ascii=True))
+            self.output.write('\n')
+            self.output.flush()
+        else:
+            self.output.write(',\n    ' if self.count else '[\n    ')
+            self.output.write(json.dumps(record, indent=4, ensure_ascii=True).replace('\n', '\n    '))
+
+        self.count += 1
+
+    def close(self) -> None:
+        if not self.ndjson:
+            self.output.write('\n]' if self.count else '[]')
+        self.output.flush()
+
+
+class ServerThrottle:
+    """
+    keeps requests to a single RDAP server at least `interval` seconds apart,
+    different servers are queried in parallel without slowing each other down
+
+    At most `concurrency` requests are in flight overall. A request takes its slot only once its server's
+    turn has come, so lookups waiting for a busy registry do not hold back the other registries.
+    """
+    def __init__(self, interval: float, concurrency: int):
+        self.interval = interval
+        self.locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.next_slot: dict[str, float] = defaultdict(float)
+        self.in_flight = asyncio.Semaphore(concurrency)
+
+    async def acquire(self, server: str) -> None:
+        async with self.locks[server]:
+            while True:
+                delay = self.next_slot[server] - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                await self.in_flight.acquire()
+                # the server may have been paused meanwhile, its turn is taken only when it is still due
+                if self.next_slot[server] <= time.monotonic():
+                    break
+                self.in_flight.release()
+
+            # stamped with the global slot held, the requests which waited for it do not go out back-to-back
+            self.next_slot[server] = time.monotonic() + self.interval
+
+    def pause(self, server: str, delay: float) -> None:
+        self.next_slot[server] = max(self.next_slot[server], time.monotonic() + delay)
+
+    @asynccontextmanager
+    async def request(self, server: str) -> AsyncIterator[None]:
+        await self.acquire(server)
+        try:
+            yield
+        finally:
+            self.in_flight.release()
+
+
+class RdapServerDirectory:
+    """
+    domain suffix to authoritative RDAP base URL mapping, loaded from the IANA bootstrap registry
+    and completed with the redirector responses for suffixes missing there
+    """
+    def __init__(self):
+        self.servers: dict[str, str] = {}
+        # only the first domain of a TLD goes through the redirector, the rest waits for the result
+        self.discovery_locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def learn(self, tld: str, domain: str, authoritative_url: str) -> None:
+        domain_path = f"domain/{domain}".lower()
+        if authoritative_url.lower().endswith(domain_path):
+            self.servers[tld] = authoritative_url[:-len(domain_path)]
+            logging.debug("RDAP server for .%s: %s", tld, self.servers[tld])
+
+    def load_bootstrap(self, bootstrap: dict) -> None:
+        for suffixes, urls in bootstrap.get('services', []):
+            # RFC 9224 lists the preferred URL first, HTTPS is picked when available
+            base_url = next((url for url in urls if url.startswith('https://')), urls[0] if urls else None)
+            if base_url is None:
+                continue
+
+            base_url = base_url if base_url.endswith('/') else f"{base_url}/"
+            for suffix in suffixes:
+                self.servers[suffix.lower()] = base_url
+
+        logging.debug("RDAP bootstrap loaded, %d suffixes known", len(self.servers))
+
+    def lookup(self, domain: str) -> str | None:
+        labels = domain.rstrip('.').lower().split('.')
+
+        # the longest matching suffix wins
+        for position in range(1, len(labels)):
+            base_url = self.servers.get('.'.join(labels[position:]))
+            if base_url is not None:
+                return base_url
+
+        return None
+
 
 def args_parser() -> argparse.Namespace:
     """
@@ -42,6 +204,36 @@ def args_parser() -> argparse.Namespace:
                        type=str,
                        help='Path to file with domains (one per line)')
 
+    parser.add_argument('-o', '--output-format',
+                        choices=['json', 'ndjson'],
+                        default='json',
+                        help='JSON array in input order or NDJSON records written as soon as they are ready, '
+                             'default json')
+
+    parser.add_argument('-b', '--bootstrap',
+                        type=str,
+                        help='local copy of the IANA RDAP bootstrap file (dns.json), used without downloading')
+
+    parser.add_argument('--bootstrap-cache',
+                        type=str,
+                        default=BOOTSTRAP_CACHE_FILE,
+                        help=f"where the downloaded IANA RDAP bootstrap file is kept, default {BOOTSTRAP_CACHE_FILE}")
+
+    parser.add_argument('--bootstrap-max-age',
+                        type=float,
+                        default=7.0,
+                        help='days after which the cached IANA RDAP bootstrap file is downloaded again, default 7')
+
+    parser.add_argument('-c', '--concurrency',
+                        type=int,
+                        default=20,
+                        help='number of domains queried in parallel, default 20')
+
+    parser.add_argument('-i', '--interval',
+                        type=float,
+                        default=1.0,
+                        help='minimal delay in seconds between requests to the same RDAP server, default 1')
+
     return parser.parse_args()
 
 
@@ -55,14 +247,106 @@ def logger_setup(cli_params: argparse.Namespace) -> None:
     logging.debug("CLI arguments: %s", pformat(cli_params))
 
 
-def get_rdap_data(domain: str) -> dict[str, str | list[Any]]:
+def download_bootstrap(cache_file: str) -> dict:
+    response = httpx.get(IANA_BOOTSTRAP_URL, timeout=HTTP_TIMEOUT, follow_redirects=True)
+    response.raise_for_status()
+    bootstrap = response.json()
+
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    temp_file = f"{cache_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as bootstrap_file:
+        json.dump(bootstrap, bootstrap_file)
+    os.replace(temp_file, cache_file)
+
+    return bootstrap
+
+
+def read_bootstrap(cli_params: argparse.Namespace) -> dict | None:
+    if cli_params.bootstrap:
+        with open(cli_params.bootstrap, 'r', encoding='utf-8') as bootstrap_file:
+            return json.load(bootstrap_file)
+
+    cache_file = cli_params.bootstrap_cache
+    cache_age = (time.time() - os.path.getmtime(cache_file)) if os.path.exists(cache_file) else None
+
+    if cache_age is None or cache_age > cli_params.bootstrap_max_age * 86400:
+        try:
+            logging.debug("Downloading RDAP bootstrap from %s", IANA_BOOTSTRAP_URL)
+            return download_bootstrap(cache_file)
+        except (httpx.HTTPError, OSError, ValueError) as err:
+            logging.warning("RDAP bootstrap download failed: %s", str(err))
+            if cache_age is None:
+                logging.warning("Falling back to %s for all domains", RDAP_REDIRECTOR_URL)
+                return None
+
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as bootstrap_file:
+            return json.load(bootstrap_file)
+    except (OSError, ValueError) as err:
+        logging.warning("Cached RDAP bootstrap %s unusable: %s", cache_file, str(err))
+        return None
+
+
+async def rdap_get(client: httpx.AsyncClient,
+                   throttle: ServerThrottle,
+                   url: str | httpx.URL,
+                   follow_redirects: bool) -> httpx.Response:
+    server = httpx.URL(url).netloc.decode()
+
+    for attempt in range(MAX_RETRIES):
+        async with throttle.request(server):
+            response = await client.get(url, follow_redirects=follow_redirects)
+        if response.status_code != 429:
+            return response
+
+        retry_after = response.headers.get('Retry-After', '')
+        delay = float(retry_after) if retry_after.isdigit() else throttle.interval * 2 ** (attempt + 1)
+        logging.warning("RDAP server %s is throttling, pausing it for %.1fs", server, delay)
+        throttle.pause(server, delay)
+
+    async with throttle.request(server):
+        return await client.get(url, follow_redirects=follow_redirects)
+
+
+async def get_rdap_response(client: httpx.AsyncClient,
+                            throttle: ServerThrottle,
+                            directory: RdapServerDirectory,
+                            domain: str) -> httpx.Response:
+    base_url = directory.lookup(domain)
+
+    if base_url is None:
+        # suffix unknown to the bootstrap, the redirector points to the authoritative server
+        # and it is remembered for the rest of the TLD
+        tld = domain.rstrip('.').rsplit('.', 1)[-1].lower()
+        async with directory.discovery_locks[tld]:
+            base_url = directory.lookup(domain)
+            if base_url is None:
+                response = await rdap_get(client, throttle, f"{RDAP_REDIRECTOR_URL}/domain/{domain}",
+                                          follow_redirects=False)
+                if not response.is_redirect or response.next_request is None:
+                    return response
+
+                authoritative_url = str(response.next_request.url)
+                directory.learn(tld, domain, authoritative_url)
+
+                return await rdap_get(client, throttle, authoritative_url, follow_redirects=True)
+
+    return await rdap_get(client, throttle, f"{base_url}domain/{domain}", follow_redirects=True)
+
+
+async def get_rdap_data(client: httpx.AsyncClient,
+                        throttle: ServerThrottle,
+                        directory: RdapServerDirectory,
+                        domain: str) -> dict[str, str | list[Any]]:
     logging.debug("Getting RDAP details for domain: %s", domain)
 
     validators.domain(domain)
 
-    rdap_data = httpx.get(
-        f"https://rdap.org/domain/{domain}", follow_redirects=True)
-    time.sleep(1)
+    try:
+        rdap_data = await get_rdap_response(client, throttle, directory, domain)
+    except httpx.HTTPError as err:
+        logging.error("RDAP request failed for domain %s: %s", domain, str(err))
+        return get_empty_output_data(domain)
 
     if rdap_data.status_code == 404:
         logging.info(
@@ -74,30 +358,44 @@ def get_rdap_data(domain: str) -> dict[str, str | list[Any]]:
             "RDAP access forbidden for domain: %s", domain)
         return get_empty_output_data(domain)
 
-    rdap_data.raise_for_status()
+    if rdap_data.is_error:
+        logging.error("RDAP error %d for domain: %s", rdap_data.status_code, domain)
+        return get_empty_output_data(domain)
+
+    try:
+        rdap_json = rdap_data.json()
+    except ValueError as err:
+        logging.error("Invalid RDAP response for domain %s: %s", domain, str(err))
+        return get_empty_output_data(domain)
+
+    # registry responses are large, formatting them is skipped unless they get logged
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("RDAP data received: %s", pformat(rdap_json))
 
-    logging.debug("RDAP data received: %s", pformat(rdap_data.json()))
+    output_data = extract_output_data(domain, rdap_json)
 
+    logging.debug("Details for %s\n%s", domain,
+                  json.dumps(output_data, indent=None))
+
+    return output_data
+
+
+def extract_output_data(domain: str, rdap_json: dict) -> dict[str, str | list[Any]]:
     nameservers = [item.get('ldhName')
-                   for item in rdap_data.json().get('nameservers', [])]
+                   for item in rdap_json.get('nameservers', [])]
 
     try:
         registar = [[inneritem for inneritem in item.get('vcardArray', [])[1] if inneritem[0] == 'fn'][0][3]
-                    for item in rdap_data.json().get('entities', [])]
+                    for item in rdap_json.get('entities', [])]
     except (IndexError, KeyError):
         registar = None
 
-    output_data = {
+    return {
         'domain': domain,
         'nameservers': nameservers,
         'registar': registar
     }
 
-    logging.debug("Details for %s\n%s", domain,
-                  json.dumps(output_data, indent=None))
-
-    return output_data
-
 
 def get_empty_output_data(domain: str) -> dict[str, str | None]:
     return {
@@ -107,12 +405,66 @@ def get_empty_output_data(domain: str) -> dict[str, str | None]:
     }
 
 
-def main(domains2check: list[str]) -> None:
-    logging.debug("Getting RDAP details for domains: %s", pformat(domains2check))
+async def iter_rdap_data(domains2check: Iterable[str],
+                         directory: RdapServerDirectory,
+                         cli_params: argparse.Namespace) -> AsyncIterator[dict[str, str | list[Any]]]:
+    """
+    yields the domain details with at most `concurrency` requests in flight, in input order
+    or, for NDJSON output, as soon as they are ready
+    """
+    concurrency = cli_params.concurrency
+    throttle = ServerThrottle(cli_params.interval, concurrency)
+    ordered = cli_params.output_format == 'json'
+
+    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
+        # more lookups than request slots are started, those waiting for a busy server leave
+        # the slots to lookups for the other servers
+        window_size = concurrency * ORDERED_WINDOW_FACTOR
+        window: deque[asyncio.Task] = deque()
+        for domain in domains2check:
+            window.append(asyncio.create_task(get_rdap_data(client, throttle, directory, domain)))
+            if len(window) < window_size:
+                continue
+
+            if ordered:
+                yield await window.popleft()
+            else:
+                done, _ = await asyncio.wait(window, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    window.remove(task)
+                    yield task.result()
+
+        if ordered:
+            while window:
+                yield await window.popleft()
+        else:
+            for task in asyncio.as_completed(window):
+                yield await task
+
+
+async def write_rdap_data(domains2check: Iterable[str],
+                          directory: RdapServerDirectory,
+                          cli_params: argparse.Namespace) -> None:
+    results = iter_rdap_data(domains2check, directory, cli_params)
 
-    output_data = [get_rdap_data(item) for item in domains2check]
+    with JsonOutputWriter(sys.stdout, cli_params.output_format) as writer:
+        async for output_data in results:
+            writer.write(output_data)
 
-    json.dump(output_data, sys.stdout, indent=4, ensure_ascii=True)
+
+def main(domains2check: Iterable[str], cli_params: argparse.Namespace) -> None:
+    logging.debug("Getting RDAP details for domains")
+
+    if cli_params.concurrency < 1:
+        logging.error("Concurrency has to be a positive number, got: %d", cli_params.concurrency)
+        sys.exit(1)
+
+    directory = RdapServerDirectory()
+    bootstrap = read_bootstrap(cli_params)
+    if bootstrap is not None:
+        directory.load_bootstrap(bootstrap)
+
+    asyncio.run(write_rdap_data(domains2check, directory, cli_params))
 
 
 if __name__ == "__main__":
@@ -120,12 +472,4 @@ def main(domains2check: list[str]) -> None:
 
     logger_setup(args)
 
-    domains: list[str] = []
-    if args.domain:
-        domains.append(args.domain)
-    elif args.file:
-        with open(args.file, 'r', encoding='utf-8') as file:
-            domains = [line.strip() for line in file.read().splitlines()
-                       if line.strip() or line.strip().startswith('#') is False]
-
-    main(domains)
+    main([args.domain] if args.domain else read_domains(args.file), args)
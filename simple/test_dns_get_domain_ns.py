@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=missing-function-docstring
+"""
+checks dns_get_domain_ns.py against a local stub DNS server
+
+The stub answers NS queries from a fixed table: NS records, NXDOMAIN, an empty answer with the SOA
+of the enclosing zone, or no reply at all. Every query is recorded, so the cache file round-trip
+can be checked by the queries it saves.
+
+    python3 -m unittest simple/test_dns_get_domain_ns.py
+
+required ubuntu packages:
+    - python3-dnspython
+"""
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+import dns.message
+import dns.rcode
+import dns.rrset
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dns_get_domain_ns.py')
+
+SOA_RDATA = 'ns1.example.net. hostmaster.example.net. 1 7200 3600 1209600 300'
+
+# query name: NS targets, 'NXDOMAIN', 'SOA <zone>' for an empty answer or None for no reply
+STUB_ZONES: dict[str, list[str] | str | None] = {
+    'example.com.': ['ns1.example.com.', 'ns2.example.net.'],
+    'www.example.com.': 'SOA example.com.',
+    'missing.invalid.': 'NXDOMAIN',
+    'dropped.example.org.': None,
+}
+
+
+class StubDnsHandler(socketserver.BaseRequestHandler):
+    """
+    answers a single query from STUB_ZONES and records its name
+    """
+    def handle(self) -> None:
+        data, sock = self.request
+        query = dns.message.from_wire(data)
+        qname = query.question[0].name.to_text()
+        self.server.queries.append(qname)
+
+        zone = STUB_ZONES.get(qname, 'NXDOMAIN')
+        if zone is None:
+            return
+
+        response = dns.message.make_response(query)
+        if zone == 'NXDOMAIN':
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(dns.rrset.from_text('invalid.', 300, 'IN', 'SOA', SOA_RDATA))
+        elif isinstance(zone, str):
+            response.authority.append(dns.rrset.from_text(zone.split()[1], 300, 'IN', 'SOA', SOA_RDATA))
+        else:
+            response.answer.append(dns.rrset.from_text(qname, 300, 'IN', 'NS', *zone))
+
+        sock.sendto(response.to_wire(), self.client_address)
+
+
+class StubDnsServer(socketserver.ThreadingUDPServer):
+    """
+    stub DNS server on a free local port, the names of the queries are kept in `queries`
+    """
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubDnsHandler)
+        self.queries: list[str] = []
+
+
+class DnsGetDomainNsTest(unittest.TestCase):
+    """
+    runs the script as a command against the stub server, with NDJSON output keyed by domain
+    """
+    def setUp(self) -> None:
+        self.server = StubDnsServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.work_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.work_dir.cleanup()
+
+    def run_script(self, domains: list[str], *options: str) -> dict[str, dict]:
+        domains_file = os.path.join(self.work_dir.name, 'domains.txt')
+        with open(domains_file, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(domains) + '\n')
+
+        result = subprocess.run([sys.executable, SCRIPT,
+                                 '-n', '127.0.0.1', '-p', str(self.server.server_address[1]),
+                                 '-t', '0.5', '-r', '0', '-o', 'ndjson', '-f', domains_file, *options],
+                                capture_output=True, text=True, timeout=30, check=True)
+
+        return {record['domain']: record for record in map(json.loads, result.stdout.splitlines())}
+
+    def test_nameservers(self) -> None:
+        records = self.run_script(['example.com'])
+        self.assertEqual(records['example.com']['nameservers'], str(['ns1.example.com', 'ns2.example.net']))
+
+    def test_nxdomain(self) -> None:
+        records = self.run_script(['missing.invalid'])
+        self.assertEqual(records['missing.invalid']['nameservers'], 'Domain does not exist')
+
+    def test_no_answer(self) -> None:
+        records = self.run_script(['www.example.com'])
+        self.assertEqual(records['www.example.com']['nameservers'], 'No NS records found for domain')
+
+    def test_no_answer_parent_zone(self) -> None:
+        records = self.run_script(['www.example.com'], '--parent-zone')
+        self.assertEqual(records['www.example.com']['zone'], 'example.com')
+        self.assertEqual(records['www.example.com']['nameservers'], str(['ns1.example.com', 'ns2.example.net']))
+
+    def test_dropped_query(self) -> None:
+        records = self.run_script(['dropped.example.org', 'example.com'])
+        self.assertEqual(records['dropped.example.org']['nameservers'], 'DNS query timed out')
+        self.assertIn('ns1.example.com', records['example.com']['nameservers'])
+
+    def test_cache_file_round_trip(self) -> None:
+        cache_file = os.path.join(self.work_dir.name, 'dns-cache.json')
+        domains = ['example.com', 'www.example.com', 'missing.invalid']
+
+        first_run = self.run_script(domains, '--cache-file', cache_file)
+        first_queries = len(self.server.queries)
+        second_run = self.run_script(domains, '--cache-file', cache_file)
+
+        self.assertEqual(first_run, second_run)
+        self.assertGreater(first_queries, 0)
+        self.assertEqual(len(self.server.queries), first_queries)
+
+
+if __name__ == '__main__':
+    unittest.main()
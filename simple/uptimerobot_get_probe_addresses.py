@@ -3,9 +3,16 @@
 # pylint: disable=missing-function-docstring
 """
 get and process UptimeRobot probe addresses to import them to router.
+
+With a previous list, a plain snapshot from an earlier run or an export of the router's address list,
+the Mikrotik and Fortigate output holds only the commands adding and removing the changed addresses.
+
+The addresses are kept as integers per IP version, IPv4 before IPv6, and optionally collapsed into
+the fewest prefixes covering exactly the same addresses.
 """
 import argparse
 import ipaddress
+import re
 
 from string import Template
 from urllib.request import urlopen, Request
@@ -31,7 +38,134 @@ def read_addresses(location: str) -> list:
         raise ValueError(f"Invalid HTTP response from {UPTIMEROBOT_CHECK_LOCATIONS[location]}") from error
 
 
-def get_out_file_from_args() -> (str, str, str):
+MIKROTIK_ADDRESS_PATTERN = re.compile(r'\baddress=("[^"]*"|\S+)')
+MIKROTIK_LIST_PATTERN = re.compile(r'\blist=("[^"]*"|\S+)')
+FORTIGATE_EDIT_PATTERN = re.compile(r'^\s*edit\s+"?([^"]*)"?\s*$')
+FORTIGATE_SUBNET_PATTERN = re.compile(r'^\s*set\s+(?:subnet\s+(\S+)\s+(\S+)|ip6\s+(\S+))\s*$')
+
+IPNetwork = ipaddress.IPv4Network | ipaddress.IPv6Network
+
+IP_NETWORK_CLASSES = {4: ipaddress.IPv4Network, 6: ipaddress.IPv6Network}
+
+IP_BITS = {4: 32, 6: 128}
+
+MIKROTIK_ADDRESS_LISTS = {4: "/ip firewall address-list", 6: "/ipv6 firewall address-list"}
+
+# Fortigate keeps IPv6 objects and groups in their own tables
+FORTIGATE_TABLES = {4: ("address", "addrgrp"), 6: ("address6", "addrgrp6")}
+
+
+def parse_addresses(lines: list) -> dict[int, list[tuple[int, int]]]:
+    """
+    unique prefixes as (network address as integer, prefix length), sorted, per IP version
+    """
+    prefixes: dict[int, set[tuple[int, int]]] = {4: set(), 6: set()}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        network = ipaddress.ip_network(line, strict=False)
+        prefixes[network.version].add((int(network.network_address), network.prefixlen))
+
+    return {version: sorted(version_prefixes) for version, version_prefixes in prefixes.items()}
+
+
+def collapse_prefixes(prefixes: list[tuple[int, int]], bits: int) -> list[tuple[int, int]]:
+    """
+    fewest prefixes covering exactly the addresses of the sorted prefixes, overlapping and adjacent ones merged
+    """
+    ranges: list[list[int]] = []
+    for address, prefix_length in prefixes:
+        last = address + (1 << (bits - prefix_length)) - 1
+        if ranges and address <= ranges[-1][1] + 1:
+            ranges[-1][1] = max(ranges[-1][1], last)
+        else:
+            ranges.append([address, last])
+
+    collapsed = []
+    for first, last in ranges:
+        while first <= last:
+            # the largest block aligned at `first` which still fits in the range
+            alignment = (first & -first).bit_length() - 1 if first else bits
+            block = min(alignment, (last - first + 1).bit_length() - 1)
+            collapsed.append((first, bits - block))
+            first += 1 << block
+    return collapsed
+
+
+def to_networks(prefixes: dict[int, list[tuple[int, int]]]) -> list[IPNetwork]:
+    return [IP_NETWORK_CLASSES[version](prefix)
+            for version in sorted(prefixes)
+            for prefix in prefixes[version]]
+
+
+def network_sort_key(network: IPNetwork) -> tuple[int, int, int]:
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def format_address(network: IPNetwork) -> str:
+    """
+    single hosts without the prefix length, as the routers show them
+    """
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+def fortigate_object_name(addr_list_name: str, network: IPNetwork) -> str:
+    return f"{addr_list_name}_{format_address(network)}"
+
+
+def parse_mikrotik_export(lines: list, addr_list_name: str) -> set:
+    """
+    addresses of the list from `/ip firewall address-list export`
+    """
+    # long entries are wrapped with a backslash at the end of the line
+    entries = re.sub(r'\\\n\s*', '', '\n'.join(lines)).splitlines()
+
+    addresses = set()
+    for entry in entries:
+        address = MIKROTIK_ADDRESS_PATTERN.search(entry)
+        address_list = MIKROTIK_LIST_PATTERN.search(entry)
+        if address and address_list and address_list[1].strip('"') == addr_list_name:
+            addresses.add(ipaddress.ip_network(address[1].strip('"'), strict=False))
+    return addresses
+
+
+def parse_fortigate_config(lines: list, addr_list_name: str) -> set:
+    """
+    addresses of the list from `show firewall address` and `show firewall address6`,
+    the address objects named `<list name>_<address>`
+    """
+    addresses = set()
+    object_name = None
+    for line in lines:
+        if edit := FORTIGATE_EDIT_PATTERN.match(line):
+            object_name = edit[1]
+        elif (subnet := FORTIGATE_SUBNET_PATTERN.match(line)) and object_name \
+                and object_name.startswith(f"{addr_list_name}_"):
+            address = f"{subnet[1]}/{subnet[2]}" if subnet[1] else subnet[3]
+            addresses.add(ipaddress.ip_network(address, strict=False))
+    return addresses
+
+
+def read_previous_addresses(file_name: str, addr_list_name: str) -> set:
+    """
+    addresses the router has now, from a plain list or a Mikrotik or Fortigate export
+    """
+    with open(file_name, 'r', encoding='utf-8') as previous_file:
+        lines = previous_file.read().splitlines()
+
+    if any('address=' in line for line in lines):
+        return parse_mikrotik_export(lines, addr_list_name)
+    if any(FORTIGATE_SUBNET_PATTERN.match(line) for line in lines):
+        return parse_fortigate_config(lines, addr_list_name)
+
+    return {ipaddress.ip_network(line.strip(), strict=False)
+            for line in lines if line.strip() and not line.startswith('#')}
+
+
+def get_cli_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
 
     parser.add_argument('out_file',
@@ -46,9 +180,24 @@ def get_out_file_from_args() -> (str, str, str):
                         help='address list name for Mikrotik or Fortigate output format',
                         default='UptimeRobot')
 
-    parsed_args = parser.parse_args()
+    parser.add_argument('--location',
+                        help='UptimeRobot probe list, IPv4 only or both IPv4 and IPv6',
+                        choices=list(UPTIMEROBOT_CHECK_LOCATIONS),
+                        default='IPV4')
+
+    parser.add_argument('--collapse',
+                        action='store_true',
+                        default=False,
+                        help='merge adjacent addresses into the fewest prefixes covering exactly the same addresses')
 
-    return parsed_args.out_file, parsed_args.format, parsed_args.addr_list_name
+    parser.add_argument('--previous',
+                        help='addresses on the router now, a plain list from --snapshot or an export of the '
+                             'Mikrotik or Fortigate address list, only the changes are written')
+
+    parser.add_argument('--snapshot',
+                        help='plain list of the fetched addresses to be used as --previous next time')
+
+    return parser.parse_args()
 
 
 def write_plain_list(output_payload, file_name):
@@ -57,35 +206,116 @@ def write_plain_list(output_payload, file_name):
             out_file.write(f"{item}\n")
 
 
-def write_mikrotik_list(output_payload, file_name, addr_list_name):
-    initial_part_template = Template("/ip firewall address-list\n"
-                                     "remove [find where list=${addr_list_name}]\n")
-    initial_part = initial_part_template.substitute(addr_list_name=addr_list_name)
+def format_mikrotik_address(network: IPNetwork) -> str:
+    # RouterOS shows IPv6 entries always with the prefix length
+    return format_address(network) if network.version == 4 else str(network)
+
 
+def format_fortigate_subnet(network: IPNetwork) -> str:
+    if network.version == 4:
+        return f"set subnet {network.network_address} {network.netmask}"
+    return f"set ip6 {network}"
+
+
+def write_mikrotik_list(output_payload, file_name, addr_list_name, previous=None):
     line_template = Template("add address=${address} list=${addr_list_name}\n")
+    remove_template = Template("remove [find where list=${addr_list_name} and address=${address}]\n")
 
     with open(file_name, 'w', encoding='utf-8') as out_file:
-        out_file.write(initial_part)
-        for item in output_payload:
-            out_file.write(line_template.substitute(
-                address=item,
-                addr_list_name=addr_list_name))
+        for version, address_list in MIKROTIK_ADDRESS_LISTS.items():
+            networks = [network for network in output_payload if network.version == version]
+            previous_networks = None if previous is None else {network for network in previous
+                                                               if network.version == version}
+            # the IPv4 section is always there, as before IPv6 support
+            if version != 4 and not networks and not previous_networks:
+                continue
+
+            out_file.write(f"{address_list}\n")
+
+            if previous_networks is None:
+                out_file.write(f"remove [find where list={addr_list_name}]\n")
+                added = networks
+                removed = []
+            else:
+                added = [network for network in networks if network not in previous_networks]
+                removed = sorted(previous_networks - set(networks), key=network_sort_key)
+
+            for item in added:
+                out_file.write(line_template.substitute(
+                    address=format_mikrotik_address(item),
+                    addr_list_name=addr_list_name))
+
+            # removed only after the additions, the probes covered by a new prefix are never missing
+            for network in removed:
+                out_file.write(remove_template.substitute(
+                    address=format_mikrotik_address(network),
+                    addr_list_name=addr_list_name))
+
+
+def write_fortigate_list(output_payload, file_name, addr_list_name, previous=None):
+    """
+    address objects named `<list name>_<address>` grouped in the address group `<list name>`,
+    IPv6 ones in the IPv6 address group of the same name
+    """
+    with open(file_name, 'w', encoding='utf-8') as out_file:
+        for version, (address_table, group_table) in FORTIGATE_TABLES.items():
+            networks = [network for network in output_payload if network.version == version]
+            added = networks if previous is None else [network for network in networks if network not in previous]
+            removed = [] if previous is None else sorted((network for network in previous - set(networks)
+                                                          if network.version == version), key=network_sort_key)
+
+            if added:
+                out_file.write(f"config firewall {address_table}\n")
+                for network in added:
+                    out_file.write(f'    edit "{fortigate_object_name(addr_list_name, network)}"\n'
+                                   f'        {format_fortigate_subnet(network)}\n'
+                                   f'    next\n')
+                out_file.write("end\n")
+
+            if added or removed:
+                out_file.write(f'config firewall {group_table}\n    edit "{addr_list_name}"\n')
+                if previous is None:
+                    members = ' '.join(f'"{fortigate_object_name(addr_list_name, network)}"' for network in added)
+                    out_file.write(f"        set member {members}\n")
+                else:
+                    for network in added:
+                        out_file.write(f'        append member "{fortigate_object_name(addr_list_name, network)}"\n')
+                    for network in removed:
+                        out_file.write(f'        unselect member "{fortigate_object_name(addr_list_name, network)}"\n')
+                out_file.write("    next\nend\n")
+
+            if removed:
+                # objects can be deleted only once no group refers to them
+                out_file.write(f"config firewall {address_table}\n")
+                for network in removed:
+                    out_file.write(f'    delete "{fortigate_object_name(addr_list_name, network)}"\n')
+                out_file.write("end\n")
 
 
 def main():
-    out_file_name, out_format, out_addr_list_name = get_out_file_from_args()
+    cli_arguments = get_cli_arguments()
 
-    addresses = read_addresses("IPV4")
+    prefixes = parse_addresses(read_addresses(cli_arguments.location))
 
-    output_payload = sorted(addresses,
-                            key=lambda x: ipaddress.IPv4Network(x).network_address.packed)
+    if cli_arguments.collapse:
+        prefixes = {version: collapse_prefixes(version_prefixes, IP_BITS[version])
+                    for version, version_prefixes in prefixes.items()}
 
-    if out_format == 'mikrotik':
-        write_mikrotik_list(output_payload, out_file_name, out_addr_list_name)
-    elif out_format == 'fortigate':
-        pass
+    output_payload = to_networks(prefixes)
+
+    previous = None
+    if cli_arguments.previous:
+        previous = read_previous_addresses(cli_arguments.previous, cli_arguments.addr_list_name)
+
+    if cli_arguments.format == 'mikrotik':
+        write_mikrotik_list(output_payload, cli_arguments.out_file, cli_arguments.addr_list_name, previous)
+    elif cli_arguments.format == 'fortigate':
+        write_fortigate_list(output_payload, cli_arguments.out_file, cli_arguments.addr_list_name, previous)
     else:
-        write_plain_list(output_payload, out_file_name)
+        write_plain_list(map(format_address, output_payload), cli_arguments.out_file)
+
+    if cli_arguments.snapshot:
+        write_plain_list(map(format_address, output_payload), cli_arguments.snapshot)
 
 
 if __name__ == "__main__":